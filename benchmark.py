@@ -0,0 +1,167 @@
+'''
+Throughput benchmarks for chess_functions.
+
+Replays a synthetic, deterministic corpus of SAN games covering castling, promotion,
+captures, en passant, disambiguation and check/mate suffixes, and reports tokens/sec
+for parse_move, plies/sec for full replay, per-handler timings and peak memory.
+
+Usage:
+    python benchmark.py --games 2000 --output bench.json
+    python benchmark.py --games 2000 --baseline bench.json --tolerance 0.1
+'''
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import chess_functions as cf
+
+# Seed games the synthetic corpus is drawn from
+SEED_GAMES = [
+    # Morphy's opera game: long castling, captures, checks, file disambiguation and mate
+    'e4 e5 Nf3 d6 d4 Bg4 dxe5 Bxf3 Qxf3 dxe5 Bc4 Nf6 Qb3 Qe7 Nc3 c6 Bg5 b5 Nxb5 cxb5 '
+    'Bxb5+ Nbd7 O-O-O Rd8 Rxd7 Rxd7 Rd1 Qe6 Bxd7+ Nxd7 Qb8+ Nxb8 Rd8#',
+    # Capture promotion followed by short castling on both sides
+    'e4 d5 exd5 c6 dxc6 Nf6 cxb7 e6 bxa8=Q Bc5 Nf3 O-O Be2 Nbd7 O-O Qb6 Qxa7 Qxb2 Bxb2 Bxa7',
+    # En passant and an underpromotion capture
+    'e4 Nf6 e5 d5 exd6 Bf5 dxc7 Qd7 cxb8=N Rxb8 Nf3 Qd6',
+    # Scholar's mate
+    'e4 e5 Bc4 Nc6 Qh5 Nf6 Qxf7#',
+    # Rank disambiguation between knights on the same file
+    'Nf3 Nf6 Nd4 Nd5 d3 d6 Nd2 Nd7 N2f3 N7f6',
+]
+
+
+def synthetic_corpus(n_games, seed=0):
+    '''
+    Return n_games move lists drawn from SEED_GAMES, each truncated to a random length.
+    The same n_games and seed always give the same corpus. Raises RuntimeError if a seed game is illegal.
+    '''
+    rng = random.Random(seed)
+    games = [g.split() for g in SEED_GAMES]
+    # An illegal seed replays without validation on a corrupted board, so check them once up front
+    for game in games:
+        cf.GameReplayer(validate=True).replay(game)
+    corpus = []
+    for _ in range(n_games):
+        game = rng.choice(games)
+        corpus.append(game[:rng.randint(len(game)//2, len(game))])
+    return corpus
+
+
+def _rate(count, func, repeat=3):
+    # Best-of-repeat throughput in items per second
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def bench_parse(corpus):
+    tokens = [(i, move) for game in corpus for i, move in enumerate(game)]
+
+    def parse():
+        for move_num, move in tokens:
+            cf.parse_move(move_num, move)
+
+    def parse_cold():
+        cf._parse_token.cache_clear()
+        parse()
+
+    flat = [move for game in corpus for move in game]
+    return {
+        'parse_move_tokens_per_sec': _rate(len(tokens), parse),
+        'parse_move_cold_tokens_per_sec': _rate(len(tokens), parse_cold),
+        'parse_moves_tokens_per_sec': _rate(len(flat), lambda: cf.parse_moves(flat)),
+    }
+
+
+def bench_get_locs(n=100000):
+    board = cf.Board()
+    pieces = ['wN', 'bB', 'wR', 'bQ', 'wK'] * (n // 5)
+    return {'get_locs_calls_per_sec': _rate(len(pieces), lambda: [cf.get_locs(p, board) for p in pieces])}
+
+
+def bench_replay(corpus):
+    plies = sum(len(game) for game in corpus)
+
+    def replay():
+        for game in corpus:
+            cf.GameReplayer().replay(game)
+
+    results = {'replay_plies_per_sec': _rate(plies, replay)}
+
+    # Handler timings come from one instrumented pass, kept apart from the throughput run
+    stats = cf.enable_instrumentation()
+    try:
+        replay()
+    finally:
+        cf.disable_instrumentation()
+    results['handler_mean_us'] = stats.summary()['handler_mean_us']
+
+    tracemalloc.start()
+    replay()
+    results['replay_peak_memory_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return results
+
+
+def run(n_games, seed):
+    corpus = synthetic_corpus(n_games, seed)
+    results = {'games': n_games, 'seed': seed, 'plies': sum(len(g) for g in corpus),
+               'python': platform.python_version(), 'machine': platform.machine()}
+    results.update(bench_parse(corpus))
+    results.update(bench_get_locs())
+    results.update(bench_replay(corpus))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print each throughput metric against the baseline and return the names that regressed
+    by more than tolerance (a fraction). Metrics ending in _per_sec are higher-is-better.
+    '''
+    regressions = []
+    for name, value in results.items():
+        if not name.endswith('_per_sec') or name not in baseline:
+            continue
+        ratio = value / baseline[name]
+        flag = ''
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:35s} {baseline[name]:14,.0f} -> {value:14,.0f}  ({ratio:.2f}x){flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--games', type=int, default=2000, help='number of games in the synthetic corpus')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic corpus')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results from a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed fractional slowdown before a metric counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.games, args.seed)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
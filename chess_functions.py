@@ -1,277 +1,495 @@
+import io
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Map board rank to row and file to column
+ROW_DICT = {'1':7, '2':6, '3':5, '4':4, '5':3, '6':2, '7':1, '8':0}
+COL_DICT = {'a':0, 'b':1, 'c':2, 'd':3, 'e':4, 'f':5, 'g':6, 'h':7}
+
+# Single-pass pattern for a SAN token: castling, or optional piece letter, disambiguating
+# file/rank, capture, destination, promotion and a check/mate suffix. Trailing !/? glyphs are ignored.
+SAN_PATTERN = re.compile(r'(?:(?P<castle>[O0]-[O0])(?P<long>-[O0])?'
+                         r'|(?P<piece>[NBRQK])?(?P<from_col>[a-h])?(?P<from_row>[1-8])?(?P<capture>x)?'
+                         r'(?P<dest_col>[a-h])(?P<dest_row>[1-8])(?:=?(?P<promote>[NBRQ]))?)'
+                         r'(?P<suffix>[+#])?[!?]*')
+
+
 def parse_move(move_num, move):
     '''
     Parse attributes of algebraic chess notation.
     Board positions are transformed into 0-based indexing with row, column format.
     '''
 
-    # Create dictionary mapping board rank to row and file to column
-    row_dict = {'1':7, '2':6, '3':5, '4':4, '5':3, '6':2, '7':1, '8':0, 'nan':float('nan')}
-    col_dict = {'a':0, 'b':1, 'c':2, 'd':3, 'e':4, 'f':5, 'g':6, 'h':7, 'nan':float('nan')}
+    # Set color based on move number parity; even = white, odd = black
+    color = 'w' if move_num % 2 == 0 else 'b'
 
-    # Create empty list to contain move list dictionaries
-    move_dicts = []
+    move_dicts = _parse_token(move, color)
+    if instrumentation is not None:
+        instrumentation.plies += 1
+        if not move_dicts:
+            instrumentation.parse_failures += 1
+    if not move_dicts:
+        logger.warning('Assignment error: %s %s', move_num, move)
 
-    # List of special characters
-    chars = ['+', '#']
+    # Return copies so callers can fill in resolved origins without touching the cache
+    return([dict(d) for d in move_dicts])
 
-    # Specify whether special characters exist in move
-    chars_exist = True if any([i in chars for i in move]) else False
 
-    # Parse attributes based on special characters
-    #piece_type = None
-    capture = True if 'x' in move else False
-    castle = True if 'O' in move else False
-    check = True if '+' in move else False
-    mate = True if '#' in move else False
-    promote = True if '=' in move else False
-    if promote == True:
-        promote_type = move[-1] if mate==False and check==False else move[-2]
-    else:
-        promote_type = float('nan')
+def _move_dict(move, piece, origin_row, origin_col, dest_row, dest_col, capture, promote, promote_type, castle, check, mate):
+    return {'move':move, 'piece':piece, 'origin_row':origin_row, 'origin_col':origin_col,
+            'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture, 'promote':promote,
+            'promote_type':promote_type, 'castle':castle, 'check':check, 'mate':mate}
 
-    # Set color based on move number parity; even = white, odd = black
-    color = 'w' if move_num % 2 == 0 else 'b'
 
+@lru_cache(maxsize=16384)
+def _parse_token(move, color):
+    '''
+    Parse one SAN token for the given color in a single regex match.
+    Results are memoized on (token, color); an unparseable token returns an empty tuple.
+    '''
+    match = SAN_PATTERN.fullmatch(move)
+    if match is None:
+        return ()
+    castle, long_castle, piece, from_col, from_row, capture, dest_col, dest_row, promote_type, suffix = match.groups()
+
+    nan = float('nan')
+    check = suffix == '+'
+    mate = suffix == '#'
+    capture = capture is not None
+    promote = promote_type is not None
+    if not promote:
+        promote_type = nan
+
+    # Castling expands into a rook move followed by a king move
+    if castle:
+        row = 7 if color == 'w' else 0
+        rook_col, rook_dest, king_dest = (0, 3, 2) if long_castle else (7, 5, 6)
+        return (_move_dict(move, color+'R', row, rook_col, row, rook_dest, capture, promote, promote_type, True, check, mate),
+                _move_dict(move, color+'K', row, 4, row, king_dest, capture, promote, promote_type, True, check, mate))
+
+    # Pawn moves name only their file, and only when capturing
+    if piece is None and (from_row or bool(from_col) != capture):
+        return ()
+
+    piece_type = color + (piece or 'P')
+    origin_row = ROW_DICT[from_row] if from_row else nan
+    origin_col = COL_DICT[from_col] if from_col else nan
+    dest_row = ROW_DICT[dest_row]
+    dest_col = COL_DICT[dest_col]
+    move_dict = _move_dict(move, piece_type, origin_row, origin_col, dest_row, dest_col,
+                           capture, promote, promote_type, False, check, mate)
+
+    # Promotion adds the promoted piece appearing on the destination square
+    if promote:
+        return (move_dict, _move_dict(move, color+promote_type, dest_row, dest_col, dest_row, dest_col,
+                                      capture, promote, promote_type, False, check, mate))
+    return (move_dict,)
+
+
+def parse_moves(moves, first_move_num=0):
+    '''
+    Parse a sequence of moves in algebraic notation into one columnar DataFrame.
+    Rows carry the same fields as the parse_move dictionaries, with castling and promotion
+    expanded into their extra rows and a move_num column giving each token's ply.
+    Board positions are Int8 columns, flags are bool and pieces are categorical.
+    Tokens that parse_move would reject are dropped.
+    '''
+    moves = pd.Series(moves, dtype=object).reset_index(drop=True)
+
+    # Run the pattern once per distinct token and compute every field on the distinct tokens,
+    # so only numeric arrays are broadcast back to the moves through codes.
+    # Missing entries get their own code rather than -1, so they fail the match and are dropped
+    codes, uniques = pd.factorize(moves, use_na_sentinel=False)
+    fields = pd.Series(uniques, dtype=object).str.extract(f'^(?:{SAN_PATTERN.pattern})$')
+    u_castle = fields['castle'].notna().to_numpy()
+    u_capture = fields['capture'].notna().to_numpy()
+    u_has_dest = fields['dest_col'].notna().to_numpy()
+    u_bad_pawn = u_has_dest & fields['piece'].isna().to_numpy() & (
+        fields['from_row'].notna().to_numpy() | (fields['from_col'].notna().to_numpy() != u_capture))
+    u_valid = u_castle | (u_has_dest & ~u_bad_pawn)
+    # Piece letters as offsets from the pawn code (P=0 ... K=5); promotion letters as N=0 ... Q=3, -1 for none
+    u_letter = np.where(u_castle, 3, fields['piece'].map({'N': 1, 'B': 2, 'R': 3, 'Q': 4, 'K': 5}).fillna(0).to_numpy(dtype=np.int8))
+    u_promote_type = fields['promote'].map({'N': 0, 'B': 1, 'R': 2, 'Q': 3}).fillna(-1).to_numpy(dtype=np.int8)
+
+    move_num = np.arange(first_move_num, first_move_num+len(moves))
+    white = move_num % 2 == 0
+
+    # Token-level flags
+    castle = u_castle[codes]
+    long_castle = fields['long'].notna().to_numpy()[codes]
+    capture = u_capture[codes]
+    promote_type = u_promote_type[codes]
+    promote = promote_type >= 0
+    check = (fields['suffix'] == '+').to_numpy()[codes]
+    mate = (fields['suffix'] == '#').to_numpy()[codes]
+    valid = u_valid[codes]
+
+    # Board positions as floats with NaN for missing until the final Int8 conversion
+    home_row = np.where(white, 7.0, 0.0)
+    origin_row = np.where(castle, home_row, fields['from_row'].map(ROW_DICT).to_numpy(dtype=float)[codes])
+    origin_col = np.where(castle, np.where(long_castle, 0.0, 7.0), fields['from_col'].map(COL_DICT).to_numpy(dtype=float)[codes])
+    dest_row = np.where(castle, home_row, fields['dest_row'].map(ROW_DICT).to_numpy(dtype=float)[codes])
+    dest_col = np.where(castle, np.where(long_castle, 3.0, 5.0), fields['dest_col'].map(COL_DICT).to_numpy(dtype=float)[codes])
+    pawn_code = np.where(white, 1, 7)
+
+    # Castling adds the king move after the rook move; promotion adds the promoted piece
+    king = np.flatnonzero(castle & valid)
+    promoted = np.flatnonzero(promote & valid)
+    main = np.flatnonzero(valid)
+    token = np.concatenate([main, king, promoted])
+    order = np.lexsort((np.repeat([0, 1, 1], [len(main), len(king), len(promoted)]), token))
+    token = token[order]
+
+    def expand(main_values, king_values, promoted_values):
+        return np.concatenate([main_values[main], king_values, promoted_values])[order]
+
+    kings = np.full(len(king), 4.0)
+    king_dest = np.where(long_castle[king], 2.0, 6.0)
+    # Categories are the valid distinct tokens, in order of first appearance
+    move_codes = np.cumsum(u_valid) - 1
+    frame = pd.DataFrame({
+        'move_num': move_num[token].astype(np.int32),
+        'move': pd.Categorical.from_codes(move_codes[codes[token]], categories=uniques[u_valid]),
+        'piece': pd.Categorical.from_codes(expand(pawn_code + u_letter[codes], pawn_code[king] + 5,
+                                                  pawn_code[promoted] + 1 + promote_type[promoted]) - 1,
+                                           categories=PIECES[1:]),
+        'origin_row': expand(origin_row, home_row[king], dest_row[promoted]),
+        'origin_col': expand(origin_col, kings, dest_col[promoted]),
+        'dest_row': expand(dest_row, home_row[king], dest_row[promoted]),
+        'dest_col': expand(dest_col, king_dest, dest_col[promoted]),
+        'capture': capture[token],
+        'promote': promote[token],
+        'promote_type': pd.Categorical.from_codes(promote_type[token], categories=['N', 'B', 'R', 'Q']),
+        'castle': castle[token],
+        'check': check[token],
+        'mate': mate[token],
+    })
+    for col in ['origin_row', 'origin_col', 'dest_row', 'dest_col']:
+        frame[col] = frame[col].astype('Int8')
+    return frame
+
+
+# Piece codes used by the array-backed board; code 0 is an empty square
+PIECES = ['', 'wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECES) if piece}
+
+# Starting position in the same 0-based row/column format produced by parse_move
+INITIAL_SQUARES = bytes(
+    [PIECE_CODES[p] for p in ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR']] +
+    [PIECE_CODES['bP']]*8 + [0]*32 + [PIECE_CODES['wP']]*8 +
+    [PIECE_CODES[p] for p in ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']]
+)
+
+
+def unpack_planes(packed):
+    '''
+    Expand bit-packed planes of shape (..., 12, 8) into uint8 tensors of shape (..., 12, 8, 8).
+    '''
+    return np.unpackbits(packed, axis=-1, bitorder='little').reshape(*packed.shape[:-1], 8, 8)
+
+
+# Bitboard masks and attack tables; bit row*8 + col corresponds to board square (row, col)
+FULL_MASK = (1 << 64) - 1
+ROW_MASKS = [0xFF << (8*row) for row in range(8)]
+COL_MASKS = [0x0101010101010101 << col for col in range(8)]
+
+
+def _step_table(steps):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        for d_row, d_col in steps:
+            if 0 <= row+d_row < 8 and 0 <= col+d_col < 8:
+                mask |= 1 << ((row+d_row)*8 + col+d_col)
+        table.append(mask)
+    return table
+
+
+def _ray_table(d_row, d_col):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        row, col = row+d_row, col+d_col
+        while 0 <= row < 8 and 0 <= col < 8:
+            mask |= 1 << (row*8 + col)
+            row, col = row+d_row, col+d_col
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _step_table([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _step_table([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+# Squares attacked by a pawn on each square; white pawns advance towards row 0
+WHITE_PAWN_ATTACKS = _step_table([(-1, -1), (-1, 1)])
+BLACK_PAWN_ATTACKS = _step_table([(1, -1), (1, 1)])
+
+# Rays are paired with whether they run towards higher square indices, which decides
+# whether the nearest blocker is the lowest or the highest set bit
+BISHOP_RAYS = [(_ray_table(d_row, d_col), d_row > 0) for d_row, d_col in [(-1, -1), (-1, 1), (1, -1), (1, 1)]]
+ROOK_RAYS = [(_ray_table(d_row, d_col), d_row > 0 or (d_row == 0 and d_col > 0))
+             for d_row, d_col in [(-1, 0), (1, 0), (0, -1), (0, 1)]]
+
+
+def _slider_attacks(rays, sq, occupied):
+    attacks = 0
+    for table, ascending in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            nearest = (blockers & -blockers).bit_length()-1 if ascending else blockers.bit_length()-1
+            ray ^= table[nearest]
+        attacks |= ray
+    return attacks
+
+
+def bishop_attacks(sq, occupied):
+    return _slider_attacks(BISHOP_RAYS, sq, occupied)
+
+
+def rook_attacks(sq, occupied):
+    return _slider_attacks(ROOK_RAYS, sq, occupied)
+
+
+def queen_attacks(sq, occupied):
+    return _slider_attacks(BISHOP_RAYS, sq, occupied) | _slider_attacks(ROOK_RAYS, sq, occupied)
 
-    # Parse attributes for a move notation with 2 characters
-    if len(move) == 2:
-        piece_type = color+'P'
-        origin_row = 'nan'
-        origin_col = 'nan'
-        dest_row = move[1]
-        dest_col = move[0]
-
-
-    # Parse attributes for a move notation with 3 characters
-    if len(move) == 3:
-        # Check for castling
-        if castle:
-            # rook move
-            piece_type = color+'R'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 7
-            dest_row = 0 if color=='b' else 7
-            dest_col = 5
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            # king move
-            piece_type = color+'K'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 4
-            dest_row = 0 if color=='b' else 7
-            dest_col = 6
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            return move_dicts
-        elif chars_exist:
-            piece_type = color+'P'
-            origin_row = 'nan'
-            origin_col = 'nan'
-            dest_row = move[1]
-            dest_col = move[0]
-        else:
-            piece_type = color+'P' if move[0].islower() else color+move[0]
-            origin_row = 'nan'
-            origin_col = move[0] if move[0].islower() else 'nan'
-            dest_row = move[2]
-            dest_col = move[1]
-
-
-    # Parse attributes for a move notation with 4 characters
-    if len(move) == 4:
-        # Check for castling
-        if castle:
-            # rook move
-            piece_type = color+'R'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 7
-            dest_row = 0 if color=='b' else 7
-            dest_col = 5
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            # king move
-            piece_type = color+'K'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 4
-            dest_row = 0 if color=='b' else 7
-            dest_col = 6
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            return move_dicts
-        else:
-            if move[0].islower():
-                piece_type = color+'P'
-                origin_row = 'nan'
-                origin_col = move[0] if not capture and not promote else 'nan'
-                if promote:
-                    dest_row = move[1]
-                    dest_col = move[0]
-                elif capture:
-                    dest_row = move[3]
-                    dest_col = move[2]
-                else:
-                    dest_row = move[2]
-                    dest_col = move[1]
-            else:
-                piece_type = color+move[0]
-                origin_row = move[1] if move[1].isdigit() else 'nan'
-                origin_col = move[1] if not move[1].isdigit() and not capture and not chars_exist else 'nan'
-                dest_row = move[2] if chars_exist else move[3]
-                dest_col = move[1] if chars_exist else move[2]
-
-
-    # Parse attributes for a move notation with 5 characters
-    if len(move) == 5:
-        # Check for castling
-        if castle:
-            # rook move
-            piece_type = color+'R'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 0
-            dest_row = 0 if color=='b' else 7
-            dest_col = 3
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            # king move
-            piece_type = color+'K'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 4
-            dest_row = 0 if color=='b' else 7
-            dest_col = 2
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            return move_dicts
-        else:
-            if move[0].islower():
-                piece_type = color+'P'
-                if capture:
-                    origin_row = move[1] if not promote and not chars_exist else 'nan'
-                    origin_col = move[0]
-                    dest_row = move[4] if not chars_exist else move[3]
-                    dest_col = move[3] if not chars_exist else move[2]
-                elif promote:
-                    origin_row = 'nan'
-                    origin_col = move[0] if not chars_exist else 'nan'
-                    dest_row = move[2] if not chars_exist else move[1]
-                    dest_col = move[1] if not chars_exist else move[0]
-            else:
-                piece_type = color+move[0]
-                if chars_exist:
-                    origin_row = move[1] if move[1].isdigit() else 'nan'
-                    origin_col = move[1] if not capture and not move[1].isdigit() else 'nan'
-                    dest_row = move[3]
-                    dest_col = move[2]
-                elif capture:
-                    origin_row = move[1] if move[1].isdigit() else 'nan'
-                    origin_col = move[1] if not move[1].isdigit() else 'nan'
-                    dest_row = move[4]
-                    dest_col = move[3]
-                else:
-                    origin_row = move[2]
-                    origin_col = move[1]
-                    dest_row = move[4]
-                    dest_col = move[3]
-
-
-    # Parse attributes for a move notation with 6 characters
-    if len(move)==6:
-        # Check for castling
-        if castle:
-            # rook move
-            piece_type = color+'R'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 0
-            dest_row = 0 if color=='b' else 7
-            dest_col = 3
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            # king move
-            piece_type = color+'K'
-            origin_row = 0 if color=='b' else 7
-            origin_col = 4
-            dest_row = 0 if color=='b' else 7
-            dest_col = 2
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':origin_row,'origin_col':origin_col,
-                               'dest_row':dest_row, 'dest_col':dest_col, 'capture':capture,'promote':promote,
-                               'promote_type':promote_type,'castle':castle,'check':check, 'mate':mate})
-            return move_dicts
-        else:
-            if move[0].islower():
-                piece_type = color+'P'
-                origin_row = 'nan'
-                origin_col = move[0]
-                dest_row = move[3] if capture else move[2]
-                dest_col = move[2] if capture else move[1]
-            else:
-                piece_type = color+move[0]
-                if chars_exist and capture:
-                    origin_row = move[1] if move[1].isdigit() else 'nan'
-                    origin_col = move[1] if not move[1].isdigit() else 'nan'
-                    dest_row = move[4]
-                    dest_col = move[3]
-                elif chars_exist:
-                    origin_row = move[2]
-                    origin_col = move[1]
-                    dest_row = move[4]
-                    dest_col = move[3]
-                else:
-                    origin_row = move[2]
-                    origin_col = move[1]
-                    dest_row = move[5]
-                    dest_col = move[4]
-
-
-    # Parse attributes for a move notation with 7 characters
-    if len(move)==7:
-        if move[0].islower():
-            piece_type = color+'P'
-            origin_row = 'nan'
-            origin_col = move[0]
-            dest_row = move[3]
-            dest_col = move[2]
-        else:
-            piece_type = color+move[0]
-            origin_row = move[2]
-            origin_col = move[1]
-            dest_row = move[5]
-            dest_col = move[4]
 
+# Zobrist keys per piece code and square from a fixed seed, so hashes are stable across
+# processes and runs; code 0 (empty) hashes to zero
+_zobrist_rng = random.Random(0x5A0B)
+ZOBRIST = [[0]*64] + [[_zobrist_rng.getrandbits(64) for _ in range(64)] for _ in PIECES[1:]]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+ZOBRIST_CASTLING = [_zobrist_rng.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP = [_zobrist_rng.getrandbits(64) for _ in range(8)]
 
-    # Return transformed move
+# Castling rights bits, and the rights kept when a square is written to; any write to a king
+# or rook home square means that piece moved or was captured
+CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ = 1, 2, 4, 8
+CASTLING_KEEP = [15]*64
+CASTLING_KEEP[63] = 15 ^ CASTLE_WK
+CASTLING_KEEP[56] = 15 ^ CASTLE_WQ
+CASTLING_KEEP[60] = 15 ^ (CASTLE_WK | CASTLE_WQ)
+CASTLING_KEEP[7] = 15 ^ CASTLE_BK
+CASTLING_KEEP[0] = 15 ^ CASTLE_BQ
+CASTLING_KEEP[4] = 15 ^ (CASTLE_BK | CASTLE_BQ)
 
+
+class Board:
+    '''
+    Array-backed chess board.
+    Squares are held in a 64-element bytearray of piece codes indexed by row*8 + col,
+    so the move functions read and write plain integers instead of DataFrame cells.
+    A bitboard per piece code (bit row*8 + col set where that piece stands) is kept in
+    step with every write, so piece locations are found without scanning the board.
+    The bitboard for code 0 tracks the empty squares.
+    A Zobrist hash of the piece placement is likewise updated incrementally on every write.
+    castling holds the CASTLE_* rights still available and ep the en passant target square
+    (-1 if none); when not given, castling rights are inferred from kings and rooks on their
+    home squares.
+    '''
+    __slots__ = ('squares', 'bitboards', 'hash', 'castling', 'ep')
+
+    def __init__(self, squares=None, bitboards=None, hash=None, castling=None, ep=-1):
+        self.squares = bytearray(INITIAL_SQUARES if squares is None else squares)
+        if bitboards is None:
+            bitboards = [0]*len(PIECES)
+            for sq, code in enumerate(self.squares):
+                bitboards[code] |= 1 << sq
+        self.bitboards = list(bitboards)
+        if hash is None:
+            hash = 0
+            for sq, code in enumerate(self.squares):
+                hash ^= ZOBRIST[code][sq]
+        self.hash = hash
+        if castling is None:
+            castling = 0
+            for rights, king_sq, rook_sq, king, rook in [(CASTLE_WK, 60, 63, 'wK', 'wR'), (CASTLE_WQ, 60, 56, 'wK', 'wR'),
+                                                         (CASTLE_BK, 4, 7, 'bK', 'bR'), (CASTLE_BQ, 4, 0, 'bK', 'bR')]:
+                if self.squares[king_sq] == PIECE_CODES[king] and self.squares[rook_sq] == PIECE_CODES[rook]:
+                    castling |= rights
+        self.castling = castling
+        self.ep = ep
+
+    def __getitem__(self, loc):
+        row, col = loc
+        code = self.squares[row*8 + col]
+        return PIECES[code] if code else float('nan')
+
+    def __setitem__(self, loc, piece):
+        row, col = loc
+        self.set(int(row)*8 + int(col), 0 if pd.isna(piece) else PIECE_CODES[piece])
+
+    def set(self, sq, code):
+        bitboards = self.bitboards
+        bit = 1 << sq
+        old = self.squares[sq]
+        bitboards[old] &= ~bit
+        bitboards[code] |= bit
+        self.hash ^= ZOBRIST[old][sq] ^ ZOBRIST[code][sq]
+        self.castling &= CASTLING_KEEP[sq]
+        self.squares[sq] = code
+
+    def locs(self, code):
+        '''
+        Return the squares holding the given piece code, read from its bitboard.
+        '''
+        sqs = []
+        bb = self.bitboards[code]
+        while bb:
+            lsb = bb & -bb
+            sqs.append(lsb.bit_length() - 1)
+            bb ^= lsb
+        return sqs
+
+    def copy(self):
+        return Board(self.squares, self.bitboards, self.hash, self.castling, self.ep)
+
+    def to_packed(self):
+        '''
+        Return the position as 12 bit-packed planes, one per piece code from wP to bK,
+        as a (12, 8) uint8 array where byte r, bit c is set when the piece stands on (r, c).
+        '''
+        return np.frombuffer(b''.join(bb.to_bytes(8, 'little') for bb in self.bitboards[1:]),
+                             dtype=np.uint8).reshape(12, 8)
+
+    def to_planes(self):
+        '''
+        Return the position as a (12, 8, 8) uint8 tensor of piece planes from wP to bK.
+        '''
+        return unpack_planes(self.to_packed())
+
+    def to_frame(self):
+        '''
+        Return the board as a DataFrame of piece strings with NaN for empty squares,
+        matching the layout previously held in the global board DataFrame.
+        '''
+        cells = np.array([PIECES[code] if code else float('nan') for code in self.squares], dtype=object)
+        return pd.DataFrame(cells.reshape(8, 8))
+
+    @classmethod
+    def from_frame(cls, frame):
+        '''
+        Build a board from a DataFrame of piece strings with NaN for empty squares.
+        '''
+        return cls(0 if pd.isna(p) else PIECE_CODES[p] for p in frame.to_numpy().ravel())
+
+    @classmethod
+    def from_fen(cls, fen):
+        '''
+        Build a board from the placement, castling and en passant fields of a FEN string.
+        Side to move and move counters are read by parse_fen; raises ValueError for a malformed FEN.
+        '''
+        return parse_fen(fen)[0]
+
+    def to_fen(self, white_to_move=True, halfmove=0, fullmove=1):
+        '''
+        Serialize the board as a FEN string with the given side to move and move counters.
+        '''
+        rows = []
+        for row in range(8):
+            fen_row, empty = '', 0
+            for code in self.squares[row*8:row*8 + 8]:
+                if not code:
+                    empty += 1
+                    continue
+                if empty:
+                    fen_row += str(empty)
+                    empty = 0
+                fen_row += FEN_LETTERS[code]
+            rows.append(fen_row + (str(empty) if empty else ''))
+        castling = ''.join(letter for rights, letter in FEN_CASTLING if self.castling & rights) or '-'
+        ep = '-' if self.ep < 0 else 'abcdefgh'[self.ep & 7] + str(8 - (self.ep >> 3))
+        return f'{"/".join(rows)} {"w" if white_to_move else "b"} {castling} {ep} {halfmove} {fullmove}'
+
+
+# FEN piece letters by piece code, and castling rights in FEN order
+FEN_LETTERS = [''] + [piece[1] if piece[0] == 'w' else piece[1].lower() for piece in PIECES[1:]]
+FEN_CODES = {letter: code for code, letter in enumerate(FEN_LETTERS) if letter}
+FEN_CASTLING = [(CASTLE_WK, 'K'), (CASTLE_WQ, 'Q'), (CASTLE_BK, 'k'), (CASTLE_BQ, 'q')]
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+def parse_fen(fen):
+    '''
+    Parse a FEN string into (board, ply, halfmove), where ply counts half-moves from the start
+    of the game so its parity gives the side to move, as parse_move expects.
+    Missing trailing fields default to no castling, no en passant and move 1.
+    '''
+    fields = fen.split()
+    if not fields:
+        raise ValueError(f'Invalid FEN: {fen!r}')
+    fields += ['w', '-', '-', '0', '1'][len(fields)-1:]
+    placement, side, castling_field, ep_field, halfmove, fullmove = fields[:6]
+    squares = []
+    rows = placement.split('/')
+    for fen_row in rows:
+        width = 0
+        for ch in fen_row:
+            if ch.isdigit():
+                squares.extend([0]*int(ch))
+                width += int(ch)
+            elif ch in FEN_CODES:
+                squares.append(FEN_CODES[ch])
+                width += 1
+            else:
+                raise ValueError(f'Invalid FEN piece {ch!r}: {fen!r}')
+        if width != 8:
+            raise ValueError(f'Invalid FEN row {fen_row!r}: {fen!r}')
+    if len(rows) != 8 or side not in ('w', 'b'):
+        raise ValueError(f'Invalid FEN: {fen!r}')
+    castling = 0
+    for rights, letter in FEN_CASTLING:
+        if letter in castling_field:
+            castling |= rights
+    ep = -1
+    if ep_field != '-':
+        if len(ep_field) != 2 or ep_field[0] not in COL_DICT or ep_field[1] not in ROW_DICT:
+            raise ValueError(f'Invalid FEN en passant square {ep_field!r}: {fen!r}')
+        ep = ROW_DICT[ep_field[1]]*8 + COL_DICT[ep_field[0]]
     try:
-        move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':row_dict[origin_row],'origin_col':col_dict[origin_col],
-                           'dest_row':row_dict[dest_row], 'dest_col':col_dict[dest_col],
-                           'capture':capture,'promote':promote, 'promote_type':promote_type,
-                           'castle':castle,'check':check, 'mate':mate})
-        if promote:
-            piece_type = color+'Q'
-            move_dicts.append({'move':move, 'piece':piece_type, 'origin_row':row_dict[dest_row],'origin_col':col_dict[dest_col],
-                           'dest_row':row_dict[dest_row], 'dest_col':col_dict[dest_col],
-                           'capture':capture,'promote':promote, 'promote_type':promote_type,
-                           'castle':castle,'check':check, 'mate':mate})
-    except:
-        print('Assignment error:', move_num, move)
-
-    return(move_dicts)
-
-
-def get_locs(piece):
-    locs = []
-    for col in board.columns:
-        row_idx = list(board.loc[board[col]==piece,col].index)
-        locs.extend([(i, col) for i in row_idx]) if len(row_idx)>0 else None
-    return(locs)
+        halfmove, fullmove = int(halfmove), int(fullmove)
+    except ValueError:
+        raise ValueError(f'Invalid FEN move counters: {fen!r}')
+    ply = 2*(max(fullmove, 1) - 1) + (side == 'b')
+    return Board(squares, castling=castling, ep=ep), ply, halfmove
+
+
+def _missing(value):
+    # Fast stand-in for pd.isna on the scalar row/column values passed to the move functions
+    return value is None or value is pd.NA or value != value
+
+
+def _relocate(board, o_row, o_col, dest_row, dest_col, code):
+    board.set(o_row*8 + o_col, 0)
+    board.set(dest_row*8 + dest_col, code)
+    board.ep = -1
+
+
+# Module-level board used when no board is passed to the move functions
+board = Board()
+
+
+def _get_board(b):
+    return board if b is None else b
+
+
+def get_locs(piece, board=None):
+    board = _get_board(board)
+    return([divmod(sq, 8) for sq in board.locs(PIECE_CODES[piece])])
 
 
 def print_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
@@ -291,172 +509,1301 @@ def print_move(piece, origin_row, origin_col, dest_row, dest_col, capture, updat
         raise RuntimeError('Error in move selector')
 
 
-def move_selector(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
+class ReplayStats:
+    '''
+    Counters and per-handler timings collected while instrumentation is enabled.
+    on_move, if given, is called as on_move(piece, (o_row, o_col), (dest_row, dest_col))
+    after every resolved move, replacing the per-move print the handlers used to do.
+    '''
+
+    def __init__(self, on_move=None):
+        self.on_move = on_move
+        self.plies = 0
+        self.parse_failures = 0
+        self.origin_failures = Counter()
+        self.handler_calls = Counter()
+        self.handler_ns = Counter()
+
+    def summary(self):
+        '''
+        Return the counters as a plain dictionary, with mean handler time in microseconds.
+        '''
+        return {'plies': self.plies, 'parse_failures': self.parse_failures,
+                'origin_failures': dict(self.origin_failures),
+                'handler_calls': dict(self.handler_calls),
+                'handler_mean_us': {name: self.handler_ns[name] / calls / 1000
+                                    for name, calls in self.handler_calls.items()}}
+
+
+# Active ReplayStats, or None when instrumentation is off
+instrumentation = None
+
+
+def enable_instrumentation(stats=None):
+    '''
+    Start collecting counters and handler timings into stats (a new ReplayStats by default).
+    Instrumentation is per process; returns the active ReplayStats.
+    '''
+    global instrumentation
+    instrumentation = ReplayStats() if stats is None else stats
+    return instrumentation
+
+
+def disable_instrumentation():
+    global instrumentation
+    stats, instrumentation = instrumentation, None
+    return stats
+
+
+def _instrumented_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board, board):
+    stats = instrumentation
+    handler = MOVE_HANDLERS[piece[1]]
+    start = time.perf_counter_ns()
+    try:
+        origin = handler(piece=piece, origin_row=origin_row, origin_col=origin_col,
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
+    except RuntimeError:
+        stats.origin_failures[piece[1]] += 1
+        raise
+    finally:
+        stats.handler_ns[handler.__name__] += time.perf_counter_ns() - start
+        stats.handler_calls[handler.__name__] += 1
+    if stats.on_move is not None:
+        stats.on_move(piece, origin, (dest_row, dest_col))
+    return origin
+
+
+def move_selector(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    # numpy and pandas integers (such as parse_moves' Int8 columns) overflow in square arithmetic
+    # and would leak into the bitboards, so positions are made plain ints first
+    if type(dest_row) is not int or type(dest_col) is not int:
+        dest_row, dest_col = int(dest_row), int(dest_col)
+        origin_row = origin_row if _missing(origin_row) else int(origin_row)
+        origin_col = origin_col if _missing(origin_col) else int(origin_col)
+    if instrumentation is not None and piece[1] in MOVE_HANDLERS:
+        return _instrumented_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board, board)
     if piece[1] == 'P':
         return pawn_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board)
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
     elif piece[1] == 'N':
         return knight_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board)
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
     elif piece[1] == 'B':
         return bishop_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board)
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
     elif piece[1] == 'R':
         return rook_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board)
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
     elif piece[1] == 'Q':
         return queen_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board)
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
     elif piece[1] == 'K':
         return king_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board)
+                         dest_row=dest_row, dest_col=dest_col, capture=capture, update_board = update_board, board = board)
     else:
         raise RuntimeError('Error in move selector')
 
 
-def pawn_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
-    print(piece, (origin_row, origin_col), (dest_row, dest_col))
+def pawn_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    board = _get_board(board)
+    squares = board.squares
+    code = PIECE_CODES[piece]
     sign = -1 if piece[0] == 'w' else 1
+    dest_sq = dest_row*8 + dest_col
     if capture:
-        o_row = dest_row-(1*sign) if pd.isna(origin_row) else origin_row
-        if not pd.isna(origin_col):
+        o_row = dest_row-(1*sign) if _missing(origin_row) else origin_row
+        if not _missing(origin_col) and squares[o_row*8 + origin_col] == code:
             o_col = origin_col
-        elif board.iloc[o_row, (dest_col-1)]==piece:
+        elif not _missing(origin_col):
+            raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+        elif dest_col > 0 and squares[o_row*8 + dest_col-1] == code:
             o_col = dest_col-1
-        elif board.iloc[o_row, (dest_col+1)]==piece:
+        elif dest_col < 7 and squares[o_row*8 + dest_col+1] == code:
             o_col = dest_col+1
         else:
             raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+        # A capture onto an empty square is only possible en passant
+        if not squares[dest_sq] and dest_sq != board.ep:
+            raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
     else:
-        if board.iloc[(dest_row-(1*sign)),dest_col] == piece and pd.isna(board.iloc[dest_row, dest_col]):
+        if squares[dest_sq-(8*sign)] == code and not squares[dest_sq]:
             o_row = dest_row-(1*sign)
             o_col = dest_col
-        elif board.iloc[(dest_row-(2*sign)),dest_col] == piece and pd.isna(board.iloc[dest_row, dest_col]):
+        elif squares[dest_sq-(16*sign)] == code and not squares[dest_sq]:
             o_row = dest_row-(2*sign)
             o_col = dest_col
         else:
             raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
     if update_board:
-        board.iloc[o_row, o_col] = float('nan')
-        board.iloc[dest_row, dest_col] = piece
+        # A pawn capturing onto the en passant square removes the pawn that skipped over it
+        if capture and dest_sq == board.ep:
+            board.set(o_row*8 + dest_col, 0)
+        _relocate(board, o_row, o_col, dest_row, dest_col, code)
+        # A double push leaves the skipped square open to en passant capture
+        if abs(dest_row - o_row) == 2:
+            board.ep = (o_row + dest_row)*4 + dest_col
     return (o_row, o_col)
 
 
-def knight_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
-    locs = get_locs(piece)
-    o_row, o_col = (float('nan'), float('nan'))
-    if not pd.isna(origin_row) and not pd.isna(origin_col):
-        o_row, o_col = (origin_row, origin_col)
-    elif not pd.isna(origin_row):
-        o_row, o_col = [i for i in locs if i[0] == origin_row][0]
-    elif not pd.isna(origin_col):
-        o_row, o_col = [i for i in locs if i[1] == origin_col][0]
-    else:
-        for i in locs:
-            if (abs(dest_row-i[0])==2 and abs(dest_col-i[1])==1) or (abs(dest_row-i[0])==1 and abs(dest_col-i[1])==2):
-                o_row, o_col = i
+def _checks_own_king(board, code, o_sq, dest_sq):
+    # Whether moving the piece on o_sq to dest_sq would expose its own king to a slider
+    bitboards = board.bitboards
+    king_code, enemy = (6, 6) if code <= 6 else (12, 0)
+    kings = bitboards[king_code]
+    if not kings:
+        return False
+    king_sq = kings.bit_length() - 1
+    occupied = ((FULL_MASK ^ bitboards[0]) & ~(1 << o_sq)) | (1 << dest_sq)
+    keep = ~(1 << dest_sq)
+    diagonal = (bitboards[3+enemy] | bitboards[5+enemy]) & keep
+    straight = (bitboards[4+enemy] | bitboards[5+enemy]) & keep
+    return bool(bishop_attacks(king_sq, occupied) & diagonal or rook_attacks(king_sq, occupied) & straight)
+
+
+def _find_origin(board, piece, origin_row, origin_col, dest_row, dest_col, attacks):
+    '''
+    Resolve the origin square of a non-pawn move from the mask of squares attacking the destination.
+    Candidates are narrowed by any disambiguating row or column, then by excluding pinned pieces.
+    '''
+    code = PIECE_CODES[piece]
+    if not _missing(origin_row) and not _missing(origin_col):
+        # A promoted piece is placed with its origin equal to the destination
+        if board.bitboards[code] >> (origin_row*8 + origin_col) & 1 or (origin_row, origin_col) == (dest_row, dest_col):
+            return (origin_row, origin_col)
+        raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+    candidates = board.bitboards[code] & attacks
+    if not _missing(origin_row):
+        candidates &= ROW_MASKS[origin_row]
+    if not _missing(origin_col):
+        candidates &= COL_MASKS[origin_col]
+    if candidates & (candidates-1):
+        dest_sq = dest_row*8 + dest_col
+        for sq in board.locs(code):
+            if candidates >> sq & 1 and _checks_own_king(board, code, sq, dest_sq):
+                candidates ^= 1 << sq
+    if not candidates:
+        raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+    return divmod(candidates.bit_length()-1, 8)
+
+
+def _occupied(board):
+    return FULL_MASK ^ board.bitboards[0]
+
+
+def knight_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    board = _get_board(board)
+    o_row, o_col = _find_origin(board, piece, origin_row, origin_col, dest_row, dest_col,
+                                KNIGHT_ATTACKS[dest_row*8 + dest_col])
+    if update_board:
+        _relocate(board, o_row, o_col, dest_row, dest_col, PIECE_CODES[piece])
+    return (o_row, o_col)
+
+
+def bishop_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    board = _get_board(board)
+    o_row, o_col = _find_origin(board, piece, origin_row, origin_col, dest_row, dest_col,
+                                bishop_attacks(dest_row*8 + dest_col, _occupied(board)))
+    if update_board:
+        _relocate(board, o_row, o_col, dest_row, dest_col, PIECE_CODES[piece])
+    return (o_row, o_col)
+
+
+def rook_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    board = _get_board(board)
+    o_row, o_col = _find_origin(board, piece, origin_row, origin_col, dest_row, dest_col,
+                                rook_attacks(dest_row*8 + dest_col, _occupied(board)))
+    if update_board:
+        _relocate(board, o_row, o_col, dest_row, dest_col, PIECE_CODES[piece])
+    return (o_row, o_col)
+
+
+def queen_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    board = _get_board(board)
+    o_row, o_col = _find_origin(board, piece, origin_row, origin_col, dest_row, dest_col,
+                                queen_attacks(dest_row*8 + dest_col, _occupied(board)))
+    if update_board:
+        _relocate(board, o_row, o_col, dest_row, dest_col, PIECE_CODES[piece])
+    return (o_row, o_col)
+
+
+def king_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True, board = None):
+    board = _get_board(board)
+    kings = board.bitboards[PIECE_CODES[piece]]
+    if not kings:
+        raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+    o_row, o_col = divmod(kings.bit_length()-1, 8)
+    if update_board:
+        _relocate(board, o_row, o_col, dest_row, dest_col, PIECE_CODES[piece])
+    return (o_row, o_col)
+
+
+MOVE_HANDLERS = {'P': pawn_move, 'N': knight_move, 'B': bishop_move, 'R': rook_move, 'Q': queen_move, 'K': king_move}
+
+
+# Castling as (right, king origin, king destination, rook origin, rook destination, squares that must be empty)
+CASTLES = [(CASTLE_WK, 60, 62, 63, 61, (61, 62)), (CASTLE_WQ, 60, 58, 56, 59, (57, 58, 59)),
+           (CASTLE_BK, 4, 6, 7, 5, (5, 6)), (CASTLE_BQ, 4, 2, 0, 3, (1, 2, 3))]
+
+
+def attackers(board, sq, by_white, occupied=None):
+    '''
+    Return the bitboard of by_white's pieces attacking sq, given the occupancy mask (the board's by default).
+    '''
+    bitboards = board.bitboards
+    if occupied is None:
+        occupied = FULL_MASK ^ bitboards[0]
+    enemy = 0 if by_white else 6
+    pawns = BLACK_PAWN_ATTACKS[sq] if by_white else WHITE_PAWN_ATTACKS[sq]
+    return ((pawns & bitboards[1+enemy]) | (KNIGHT_ATTACKS[sq] & bitboards[2+enemy]) |
+            (KING_ATTACKS[sq] & bitboards[6+enemy]) |
+            (bishop_attacks(sq, occupied) & (bitboards[3+enemy] | bitboards[5+enemy])) |
+            (rook_attacks(sq, occupied) & (bitboards[4+enemy] | bitboards[5+enemy]))) & occupied
+
+
+def in_check(board, white):
+    kings = board.bitboards[6 if white else 12]
+    return bool(kings) and bool(attackers(board, kings.bit_length()-1, not white))
+
+
+def _is_legal(board, white, o_sq, dest_sq, captured_sq):
+    # Whether moving o_sq to dest_sq (capturing on captured_sq) leaves the mover's king unattacked
+    bitboards = board.bitboards
+    kings = bitboards[6 if white else 12]
+    if not kings:
+        return True
+    king_sq = dest_sq if kings >> o_sq & 1 else kings.bit_length()-1
+    occupied = ((FULL_MASK ^ bitboards[0]) & ~(1 << o_sq) & ~(1 << captured_sq)) | (1 << dest_sq)
+    return not attackers(board, king_sq, not white, occupied) & ~(1 << dest_sq)
+
+
+def _can_castle(board, white, castle):
+    rights, king_sq, king_dest, rook_sq, _, empty = castle
+    if not board.castling & rights or any(board.squares[sq] for sq in empty):
+        return False
+    # The king may not castle out of, through or into check
+    return not any(attackers(board, sq, not white) for sq in (king_sq, (king_sq+king_dest)//2, king_dest))
+
+
+def pseudo_legal_moves(board, white):
+    '''
+    Return the pseudo-legal moves for one side as (origin square, destination square, promotion code)
+    tuples, with promotion code 0 for non-promotions. Castling is given as the king's two-square move.
+    '''
+    bitboards = board.bitboards
+    squares = board.squares
+    own, enemy_lo = (range(1, 7), 7) if white else (range(7, 13), 1)
+    own_mask = 0
+    for code in own:
+        own_mask |= bitboards[code]
+    occupied = FULL_MASK ^ bitboards[0]
+    enemy_mask = occupied ^ own_mask
+    moves = []
+    pawn, knight, bishop, rook, queen, king = own
+
+    # Pawns: pushes, double pushes from the starting row, captures, en passant and promotions
+    step, start_row, last_row = (-8, 6, 0) if white else (8, 1, 7)
+    pawn_attacks = WHITE_PAWN_ATTACKS if white else BLACK_PAWN_ATTACKS
+    ep_mask = 1 << board.ep if board.ep >= 0 else 0
+    promotions = [knight, bishop, rook, queen]
+    for sq in board.locs(pawn):
+        targets = pawn_attacks[sq] & (enemy_mask | ep_mask)
+        dest = sq + step
+        if not squares[dest]:
+            targets |= 1 << dest
+            if sq >> 3 == start_row and not squares[dest+step]:
+                targets |= 1 << (dest+step)
+        while targets:
+            lsb = targets & -targets
+            dest = lsb.bit_length()-1
+            targets ^= lsb
+            if dest >> 3 == last_row:
+                moves.extend((sq, dest, promote) for promote in promotions)
             else:
-                continue
-    if not pd.isna(o_row) and not pd.isna(o_col):
-        if update_board:
-            board.iloc[o_row, o_col] = float('nan')
-            board.iloc[dest_row, dest_col] = piece
-        return (o_row, o_col)
+                moves.append((sq, dest, 0))
+
+    # Pieces: attack mask from each origin, minus own pieces
+    for code, attacks in ((knight, None), (bishop, bishop_attacks), (rook, rook_attacks),
+                          (queen, queen_attacks), (king, None)):
+        for sq in board.locs(code):
+            if code == knight:
+                targets = KNIGHT_ATTACKS[sq]
+            elif code == king:
+                targets = KING_ATTACKS[sq]
+            else:
+                targets = attacks(sq, occupied)
+            targets &= ~own_mask
+            while targets:
+                lsb = targets & -targets
+                targets ^= lsb
+                moves.append((sq, lsb.bit_length()-1, 0))
+
+    for castle in CASTLES[:2] if white else CASTLES[2:]:
+        if squares[castle[1]] == king and _can_castle(board, white, castle):
+            moves.append((castle[1], castle[2], 0))
+    return moves
+
+
+def legal_moves(board, white):
+    '''
+    Return the legal moves for one side, in the same form as pseudo_legal_moves.
+    Moves that leave the mover's own king in check, including moves of pinned pieces, are removed.
+    '''
+    pawn = 1 if white else 7
+    legal = []
+    for o_sq, dest_sq, promote in pseudo_legal_moves(board, white):
+        captured_sq = dest_sq
+        if dest_sq == board.ep and board.squares[o_sq] == pawn:
+            captured_sq = (o_sq & ~7) | (dest_sq & 7)
+        if _is_legal(board, white, o_sq, dest_sq, captured_sq):
+            legal.append((o_sq, dest_sq, promote))
+    return legal
+
+
+def legal_origins(board, piece, dest_row, dest_col, origin_row=float('nan'), origin_col=float('nan'), castle=False):
+    '''
+    Return the (row, col) origins from which piece can legally move to (dest_row, dest_col),
+    narrowed by any disambiguating origin row or column. Only moves of that piece to that square
+    are generated, which is much cheaper than a full legal_moves call.
+    With castle=True only the king's castling move is considered, and otherwise never castling,
+    so a plain king move such as Kg1 cannot pass as O-O.
+    '''
+    code = PIECE_CODES[piece]
+    white = code <= 6
+    bitboards = board.bitboards
+    squares = board.squares
+    dest_sq = dest_row*8 + dest_col
+    target = squares[dest_sq]
+    if target and (target <= 6) == white:
+        return []
+    occupied = FULL_MASK ^ bitboards[0]
+    kind = piece[1]
+    captured_sq = dest_sq
+    if kind == 'P':
+        step = -8 if white else 8
+        candidates = (BLACK_PAWN_ATTACKS if white else WHITE_PAWN_ATTACKS)[dest_sq] if target or dest_sq == board.ep else 0
+        if not target:
+            if dest_sq == board.ep:
+                captured_sq = dest_sq - step
+            else:
+                candidates = 1 << (dest_sq-step) if 0 <= dest_sq-step < 64 else 0
+                if dest_row == (4 if white else 3) and not squares[dest_sq-step]:
+                    candidates |= 1 << (dest_sq-2*step)
+        candidates &= bitboards[code]
+    elif kind == 'N':
+        candidates = KNIGHT_ATTACKS[dest_sq] & bitboards[code]
+    elif kind == 'B':
+        candidates = bishop_attacks(dest_sq, occupied) & bitboards[code]
+    elif kind == 'R':
+        candidates = rook_attacks(dest_sq, occupied) & bitboards[code]
+    elif kind == 'Q':
+        candidates = queen_attacks(dest_sq, occupied) & bitboards[code]
+    elif castle:
+        # _can_castle already checks every square the king crosses
+        candidates = 0
+        for c in CASTLES[:2] if white else CASTLES[2:]:
+            if c[2] == dest_sq and squares[c[1]] == code and _can_castle(board, white, c):
+                candidates |= 1 << c[1]
     else:
-        raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+        candidates = KING_ATTACKS[dest_sq] & bitboards[code]
+    if not _missing(origin_row):
+        candidates &= ROW_MASKS[origin_row]
+    if not _missing(origin_col):
+        candidates &= COL_MASKS[origin_col]
+    origins = []
+    while candidates:
+        lsb = candidates & -candidates
+        candidates ^= lsb
+        o_sq = lsb.bit_length()-1
+        if castle or _is_legal(board, white, o_sq, dest_sq, captured_sq):
+            origins.append(divmod(o_sq, 8))
+    return origins
 
 
-def bishop_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
-    locs = get_locs(piece)
-    o_row, o_col = (float('nan'), float('nan'))
-    if not pd.isna(origin_row) and not pd.isna(origin_col):
-        o_row, o_col = (origin_row, origin_col)
-    elif not pd.isna(origin_row):
-        o_row, o_col = [i for i in locs if i[0] == origin_row][0]
-    elif not pd.isna(origin_col):
-        o_row, o_col = [i for i in locs if i[1] == origin_col][0]
+def validate_move(board, move_dicts):
+    '''
+    Check that the move parsed into move_dicts resolves to exactly one legal move on board.
+    Fills the legal origin into the move dictionary and raises RuntimeError for an illegal,
+    ambiguous or inconsistent move (wrong capture flag, a check suffix that gives no check).
+    '''
+    d = move_dicts[1] if move_dicts[0]['castle'] else move_dicts[0]
+    piece = d['piece']
+    dest_row, dest_col = d['dest_row'], d['dest_col']
+    if d['castle']:
+        origins = [o for o in legal_origins(board, piece, dest_row, dest_col, castle=True)
+                   if o == (d['origin_row'], d['origin_col'])]
+        if not origins or abs(dest_col - d['origin_col']) != 2:
+            raise RuntimeError(f'Illegal move {d["move"]}: castling not allowed')
     else:
-        for i in locs:
-            curr_row, curr_col = i
-            row_dist = dest_row - curr_row
-            row_sign = 1 if curr_row < dest_row else -1
-            col_dist = dest_col - curr_col
-            col_sign = 1 if curr_col < dest_col else -1
-            if abs(row_dist) != abs(col_dist):
+        origins = legal_origins(board, piece, dest_row, dest_col, d['origin_row'], d['origin_col'])
+    if len(origins) != 1:
+        problem = 'no legal origin' if not origins else f'ambiguous between {origins}'
+        raise RuntimeError(f'Illegal move {d["move"]} for {piece} to ({dest_row}, {dest_col}): {problem}')
+    dest_sq = dest_row*8 + dest_col
+    captures = bool(board.squares[dest_sq]) or (piece[1] == 'P' and dest_sq == board.ep)
+    if captures != d['capture']:
+        raise RuntimeError(f'Illegal move {d["move"]}: capture flag does not match the board')
+    if piece[1] == 'P' and (dest_row in (0, 7)) != d['promote']:
+        raise RuntimeError(f'Illegal move {d["move"]}: promotion does not match the destination')
+    d['origin_row'], d['origin_col'] = origins[0]
+    # Try the move and take it back, so a failed check test leaves the board unchanged
+    if d['check'] or d['mate']:
+        promote = PIECE_CODES[move_dicts[1]['piece']] if d['promote'] else 0
+        undo = make_move(board, (d['origin_row']*8 + d['origin_col'], dest_sq, promote))
+        gives_check = in_check(board, piece[0] == 'b')
+        unmake_move(board, undo)
+        if not gives_check:
+            raise RuntimeError(f'Illegal move {d["move"]}: marked as check but gives no check')
+
+
+# Everything needed to take back one move: the moved piece and its squares, the captured piece and
+# where it stood (differs from dest for en passant), the promoted piece code, the castling rook's
+# squares (-1 if not castling), and the castling rights and en passant square before the move
+Undo = namedtuple('Undo', ['origin', 'dest', 'piece', 'captured', 'captured_sq', 'promote',
+                           'rook_origin', 'rook_dest', 'castling', 'ep'])
+
+
+def make_move(board, move):
+    '''
+    Play a move given as (origin square, destination square, promotion code), as produced by
+    legal_moves, and return the Undo record that unmake_move needs to take it back.
+    '''
+    o_sq, dest_sq, promote = move
+    squares = board.squares
+    code = squares[o_sq]
+    pawn = code == 1 or code == 7
+    captured_sq = dest_sq
+    if pawn and dest_sq == board.ep:
+        captured_sq = (o_sq & ~7) | (dest_sq & 7)
+    rook_origin = rook_dest = -1
+    if (code == 6 or code == 12) and abs((dest_sq & 7) - (o_sq & 7)) == 2:
+        for castle in CASTLES:
+            if castle[1] == o_sq and castle[2] == dest_sq:
+                rook_origin, rook_dest = castle[3], castle[4]
+    undo = Undo(o_sq, dest_sq, code, squares[captured_sq], captured_sq, promote,
+                rook_origin, rook_dest, board.castling, board.ep)
+    if captured_sq != dest_sq:
+        board.set(captured_sq, 0)
+    if rook_origin >= 0:
+        rook = squares[rook_origin]
+        board.set(rook_origin, 0)
+        board.set(rook_dest, rook)
+    board.set(o_sq, 0)
+    board.set(dest_sq, promote or code)
+    board.ep = (o_sq + dest_sq) // 2 if pawn and abs(dest_sq - o_sq) == 16 else -1
+    return undo
+
+
+def unmake_move(board, undo):
+    '''
+    Take back the move recorded in undo, restoring the board exactly, in constant time.
+    '''
+    board.set(undo.dest, 0)
+    board.set(undo.origin, undo.piece)
+    if undo.captured:
+        board.set(undo.captured_sq, undo.captured)
+    if undo.rook_origin >= 0:
+        rook = board.squares[undo.rook_dest]
+        board.set(undo.rook_dest, 0)
+        board.set(undo.rook_origin, rook)
+    board.castling = undo.castling
+    board.ep = undo.ep
+
+
+class GameReplayer:
+    '''
+    Replay a game on a board owned by this instance.
+    Each replayer holds its own Board and ply counter, so any number of games can be
+    replayed side by side, in threads or in worker processes, without the global board.
+    With validate=True every move is checked with validate_move before it is applied.
+    With keep_history=True an Undo record is kept per ply, so undo() and redo() step
+    backwards and forwards through the game without copying the board.
+    '''
+
+    def __init__(self, board=None, validate=False, keep_history=False):
+        self.board = Board() if board is None else board
+        self.ply = 0
+        self.halfmove = 0
+        self.validate = validate
+        self.history = [] if keep_history else None
+        self.future = []
+
+    def reset(self, start_fen=None):
+        '''
+        Return to the starting position, or to the position given by start_fen.
+        '''
+        if start_fen is None:
+            self.board, self.ply, self.halfmove = Board(), 0, 0
+        else:
+            self.board, self.ply, self.halfmove = parse_fen(start_fen)
+        if self.history is not None:
+            self.history = []
+        self.future = []
+
+    def copy(self):
+        replayer = GameReplayer(self.board.copy(), self.validate)
+        replayer.ply = self.ply
+        replayer.halfmove = self.halfmove
+        if self.history is not None:
+            replayer.history = list(self.history)
+            replayer.future = list(self.future)
+        return replayer
+
+    @classmethod
+    def from_fen(cls, fen, validate=False, keep_history=False):
+        replayer = cls(validate=validate, keep_history=keep_history)
+        replayer.reset(fen)
+        return replayer
+
+    @property
+    def fen(self):
+        '''
+        FEN string of the current position, with side to move and move counters from the ply.
+        '''
+        return self.board.to_fen(self.ply % 2 == 0, self.halfmove, self.ply // 2 + 1)
+
+    @property
+    def key(self):
+        '''
+        Zobrist key of the current position: the board hash combined with the side to move,
+        castling rights and any capturable en passant square.
+        '''
+        board = self.board
+        key = board.hash ^ ZOBRIST_CASTLING[board.castling]
+        if self.ply % 2:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        # The en passant square only distinguishes positions when a pawn can actually capture on it
+        if board.ep >= 0:
+            black_to_move = self.ply % 2
+            pawns = board.bitboards[7 if black_to_move else 1]
+            if (BLACK_PAWN_ATTACKS if not black_to_move else WHITE_PAWN_ATTACKS)[board.ep] & pawns:
+                key ^= ZOBRIST_EP[board.ep & 7]
+        return key
+
+    def apply(self, move_dicts, update_board = True):
+        '''
+        Apply the move dictionaries returned by parse_move to this replayer's board.
+        The resolved origin of each move is filled into its origin_row and origin_col.
+        '''
+        for d in move_dicts:
+            d['origin_row'], d['origin_col'] = move_selector(d['piece'], d['origin_row'], d['origin_col'],
+                                                             d['dest_row'], d['dest_col'], d['capture'],
+                                                             update_board = update_board, board = self.board)
+        return move_dicts
+
+    def push(self, move):
+        '''
+        Parse a single move in algebraic notation and apply it at the current ply.
+        A token that is not algebraic notation raises RuntimeError without changing the position.
+        '''
+        move_dicts = parse_move(self.ply, move)
+        # Skipping a token would hand every later move to the wrong side
+        if not move_dicts:
+            raise RuntimeError(f'Illegal move {move}: not algebraic notation')
+        if self.validate:
+            validate_move(self.board, move_dicts)
+        halfmove = self.halfmove
+        if self.history is None:
+            self.apply(move_dicts)
+        else:
+            self._apply_recorded(move_dicts, halfmove)
+        # The halfmove clock restarts on pawn moves and captures
+        self.halfmove = 0 if move_dicts[0]['piece'][1] == 'P' or move_dicts[0]['capture'] else halfmove + 1
+        self.ply += 1
+        return move_dicts
+
+    def _apply_recorded(self, move_dicts, halfmove):
+        # Apply a parsed move and push its Undo record with the halfmove clock before it
+        board = self.board
+        castle = move_dicts[0]['castle']
+        d = move_dicts[1] if castle else move_dicts[0]
+        dest_sq = d['dest_row']*8 + d['dest_col']
+        captured_sq = dest_sq
+        if d['piece'][1] == 'P' and d['capture'] and not board.squares[dest_sq]:
+            captured_sq = dest_sq + (8 if d['piece'][0] == 'w' else -8)
+        captured, castling, ep = board.squares[captured_sq], board.castling, board.ep
+        self.apply(move_dicts)
+        rook = move_dicts[0]
+        undo = Undo(d['origin_row']*8 + d['origin_col'], dest_sq, PIECE_CODES[d['piece']], captured, captured_sq,
+                    PIECE_CODES[move_dicts[1]['piece']] if d['promote'] else 0,
+                    rook['origin_row']*8 + rook['origin_col'] if castle else -1,
+                    rook['dest_row']*8 + rook['dest_col'] if castle else -1, castling, ep)
+        self.history.append((undo, move_dicts, halfmove))
+        self.future = []
+
+    def undo(self):
+        '''
+        Take back the last ply and return its move dictionaries. Requires keep_history=True.
+        '''
+        if self.history is None:
+            raise RuntimeError('Cannot undo: history not enabled, create the replayer with keep_history=True')
+        if not self.history:
+            raise RuntimeError('Cannot undo: nothing to undo')
+        entry = self.history.pop()
+        undo, move_dicts, halfmove = entry
+        unmake_move(self.board, undo)
+        self.ply -= 1
+        self.future.append((entry, self.halfmove))
+        self.halfmove = halfmove
+        return move_dicts
+
+    def redo(self):
+        '''
+        Replay the last ply taken back by undo() and return its move dictionaries.
+        '''
+        if not self.future:
+            raise RuntimeError('Cannot redo: nothing to redo')
+        entry, self.halfmove = self.future.pop()
+        undo, move_dicts, _ = entry
+        make_move(self.board, (undo.origin, undo.dest, undo.promote))
+        self.ply += 1
+        self.history.append(entry)
+        return move_dicts
+
+    def replay(self, moves, start_fen=None):
+        '''
+        Parse and apply a sequence of moves in algebraic notation.
+        With start_fen the replayer is first reset to that position, so fragments, puzzles
+        and games resumed from a checkpoint can be replayed.
+        Returns the list of move dictionaries with resolved origins.
+        '''
+        if start_fen is not None:
+            self.reset(start_fen)
+        move_dicts = []
+        for move in moves:
+            move_dicts.extend(self.push(move))
+        return move_dicts
+
+
+def replay_shared(games):
+    '''
+    Replay a batch of games, replaying each move prefix they share only once.
+    The games are arranged in a trie of moves; the board is copied only where the trie branches,
+    and every game continues from the board at its branch point.
+    Returns (move_dicts, error) per game in input order, where move_dicts matches
+    GameReplayer().replay(moves), or is None with the error message if the game fails.
+    '''
+    # Trie nodes are (children by move, indices of games ending at this node)
+    root = ({}, [])
+    for i, moves in enumerate(games):
+        node = root
+        for move in moves:
+            children = node[0]
+            node = children.get(move) or children.setdefault(move, ({}, []))
+        node[1].append(i)
+
+    results = [None]*len(games)
+    # Each stack entry owns its replayer; path is a linked list of (move_dicts, parent path)
+    stack = [(root, None, GameReplayer(), None)]
+    while stack:
+        node, move, replayer, path = stack.pop()
+        if move is not None:
+            try:
+                path = (replayer.push(move), path)
+            except Exception as e:
+                _fail_subtree(node, str(e), results)
                 continue
-            else:
-                check_list = []
-                while (curr_row*row_sign) <= (dest_row*row_sign):
-                    check_list.append(0) if pd.isna(board.iloc[curr_row, curr_col]) else check_list.append(1)
-                    curr_row += (1*row_sign)
-                    curr_col += (1*col_sign)
-                check_list.pop if capture == True else None
-                if sum(check_list) == 0:
-                    o_row, o_col = i
-    if not pd.isna(o_row) and not pd.isna(o_col):
-        if update_board:
-            board.iloc[o_row, o_col] = float('nan')
-            board.iloc[dest_row, dest_col] = piece
-        return (o_row, o_col)
-    else:
-        raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+        if node[1]:
+            plies = []
+            p = path
+            while p is not None:
+                plies.append(p[0])
+                p = p[1]
+            move_dicts = [d for ply in reversed(plies) for d in ply]
+            for i in node[1]:
+                results[i] = ([dict(d) for d in move_dicts], None)
+        children = list(node[0].items())
+        for j, (child_move, child) in enumerate(children):
+            child_replayer = replayer if j == len(children)-1 else replayer.copy()
+            stack.append((child, child_move, child_replayer, path))
+    return results
+
+
+def _fail_subtree(node, error, results):
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        for i in node[1]:
+            results[i] = (None, error)
+        nodes.extend(node[0].values())
+
+
+class PositionCache:
+    '''
+    Least-recently-used cache of derived position features keyed by Zobrist key.
+    Identical positions reached in different games share one entry, so features such as
+    plane tensors or piece lists are computed once per distinct position.
+    '''
+
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
 
+    def __contains__(self, key):
+        return key in self.entries
 
-def rook_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
-    locs = get_locs(piece)
-    o_row, o_col = (float('nan'), float('nan'))
-    if not pd.isna(origin_row) and not pd.isna(origin_col):
-        o_row, o_col = (origin_row, origin_col)
-    elif not pd.isna(origin_row):
-        o_row, o_col = [i for i in locs if i[0] == origin_row][0]
-    elif not pd.isna(origin_col):
-        o_row, o_col = [i for i in locs if i[1] == origin_col][0]
+    def get(self, key, compute, *args):
+        '''
+        Return the cached value for key, or store and return compute(*args) on a miss.
+        '''
+        entries = self.entries
+        if key in entries:
+            self.hits += 1
+            entries.move_to_end(key)
+            return entries[key]
+        self.misses += 1
+        value = entries[key] = compute(*args)
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        return value
+
+
+# PGN header tag and movetext token patterns; movetext tokens are comments, variations,
+# NAGs, move numbers, game results and moves in algebraic notation
+PGN_HEADER = re.compile(r'\[\s*(\w+)\s*"(.*)"\s*\]')
+PGN_TOKEN = re.compile(r'\s*(?:(?P<comment>\{)|(?P<line_comment>;)|(?P<open>\()|(?P<close>\))|(?P<nag>\$\d+)'
+                       r'|(?P<number>\d+\.+)|(?P<result>1-0|0-1|1/2-1/2|\*)|(?P<move>[^\s{}();$]+))')
+
+
+def _open_pgn(path):
+    if str(path).endswith('.gz'):
+        import gzip
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if str(path).endswith('.bz2'):
+        import bz2
+        return bz2.open(path, 'rt', encoding='utf-8', errors='replace')
+    if str(path).endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading .zst PGN files requires the zstandard package')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True),
+                                encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_pgn(source):
+    '''
+    Lazily read games from a PGN file, yielding (headers, moves) per game.
+    source is a path (.gz, .bz2 and .zst are decompressed on the fly) or an open text file.
+    The file is read line by line, so memory stays flat regardless of its size.
+    Comments, variations, NAGs, move numbers and annotation glyphs are stripped from the moves.
+    '''
+    if hasattr(source, 'read'):
+        yield from _read_pgn_lines(source)
     else:
-        for i in locs:
-            curr_row, curr_col = i
-            if dest_row != curr_row and dest_col != curr_col:
+        with _open_pgn(source) as f:
+            yield from _read_pgn_lines(f)
+
+
+def _read_pgn_lines(lines):
+    headers, moves = {}, []
+    in_comment = False
+    depth = 0
+    for line in lines:
+        pos = 0
+        if in_comment:
+            pos = line.find('}') + 1
+            if not pos:
                 continue
-            else:
-                if curr_row == dest_row:
-                    col_sign = 1 if curr_col < dest_col else -1
-                    check_list = []
-                    while (curr_col*col_sign) <= (dest_col*col_sign):
-                        check_list.append(0) if pd.isna(board.iloc[dest_row, curr_col]) else check_list.append(1)
-                        curr_col += (1*col_sign)
-                    check_list.pop if capture == True else None
-                    if sum(check_list) == 0:
-                        o_row, o_col = i
-                if curr_col == dest_col:
-                    row_sign = 1 if curr_row < dest_row else -1
-                    check_list = []
-                    while (curr_row*row_sign) <= (dest_row*row_sign):
-                        check_list.append(0) if pd.isna(board.iloc[curr_row, dest_col]) else check_list.append(1)
-                        curr_row += (1*row_sign)
-                    check_list.pop if capture == True else None
-                    if sum(check_list) == 0:
-                        o_row, o_col = i
-    if not pd.isna(o_row) and not pd.isna(o_col):
-        if update_board:
-            board.iloc[o_row, o_col] = float('nan')
-            board.iloc[dest_row, dest_col] = piece
-        return (o_row, o_col)
+            in_comment = False
+        elif depth == 0 and line.startswith('['):
+            header = PGN_HEADER.match(line)
+            if header:
+                # A header after movetext starts a new game even if no result was given
+                if moves:
+                    yield headers, moves
+                    headers, moves = {}, []
+                headers[header.group(1)] = header.group(2)
+                continue
+        elif line.startswith('%'):
+            continue
+        while True:
+            token = PGN_TOKEN.match(line, pos)
+            if token is None:
+                break
+            pos = token.end()
+            kind = token.lastgroup
+            if kind == 'comment':
+                end = line.find('}', pos)
+                if end < 0:
+                    in_comment = True
+                    break
+                pos = end + 1
+            elif kind == 'line_comment':
+                break
+            elif kind == 'open':
+                depth += 1
+            elif kind == 'close':
+                depth -= 1
+            elif depth:
+                continue
+            elif kind == 'result':
+                yield headers, moves
+                headers, moves = {}, []
+            elif kind == 'move':
+                moves.append(token.group('move').rstrip('!?'))
+    if headers or moves:
+        yield headers, moves
+
+
+def replay_pgn(source):
+    '''
+    Lazily replay every game in a PGN file, yielding (headers, move_dicts) per game.
+    Each game is parsed with parse_move and applied through move_selector on its own GameReplayer,
+    starting from the position in its FEN header if it has one.
+    '''
+    for headers, moves in read_pgn(source):
+        yield headers, GameReplayer().replay(moves, start_fen=headers.get('FEN'))
+
+
+# A game starts at a header line that follows a blank line
+PGN_GAME_START = re.compile(rb'\n\r?\n\[')
+
+
+def _next_game_start(data, pos):
+    # Index of the first game-opening '[' at or after pos in data, or -1
+    match = PGN_GAME_START.search(data, max(pos - 3, 0))
+    while match and match.end() - 1 < pos:
+        match = PGN_GAME_START.search(data, match.start() + 1)
+    return match.end() - 1 if match else -1
+
+
+def _read_chunk(path, start, end):
+    # Text of the games in an uncompressed PGN file whose first header line starts in [start, end).
+    # The last game is read past end up to the next game start, so every game belongs to exactly one chunk.
+    with open(path, 'rb') as f:
+        base = max(start - 3, 0)
+        f.seek(base)
+        data = f.read(end - base)
+        begin = _next_game_start(data, start - base) if start else 0
+        if begin < 0:
+            return ''
+        stop = _next_game_start(data, end - base)
+        while stop < 0:
+            more = f.read(1 << 20)
+            if not more:
+                stop = len(data)
+                break
+            data += more
+            stop = _next_game_start(data, end - base)
+    return data[begin:stop].decode('utf-8', errors='replace')
+
+
+def _corpus_chunks(paths, chunk_size):
+    # Split uncompressed files into byte ranges of about chunk_size; compressed files cannot be
+    # entered mid-stream, so each is one chunk with end None
+    for path in paths:
+        if str(path).endswith(('.gz', '.bz2', '.zst')):
+            yield path, 0, None
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            yield path, start, start + chunk_size
+
+
+def _ply_labels(move_dicts, ply=0):
+    # Group replayed move dictionaries into one LABEL_DTYPE record per ply;
+    # castling and promotion take two dictionaries
+    labels = []
+    i = 0
+    while i < len(move_dicts):
+        size = 2 if move_dicts[i]['castle'] or move_dicts[i]['promote'] else 1
+        labels.append(move_label(ply, move_dicts[i:i+size]))
+        ply += 1
+        i += size
+    return labels
+
+
+def _replay_games(games, share_prefixes=False):
+    # Replay a batch of games into one LABEL_DTYPE array, recording failures per game instead of raising.
+    # Returns (headers, labels, offsets, errors); game i has labels[offsets[i]:offsets[i+1]].
+    # Only games from the standard starting position can share prefixes.
+    labels = [None]*len(games)
+    errors = [None]*len(games)
+    shared = [i for i, (headers, _) in enumerate(games) if share_prefixes and 'FEN' not in headers]
+    for i, (move_dicts, error) in zip(shared, replay_shared([games[i][1] for i in shared])):
+        labels[i], errors[i] = ([], error) if error else (_ply_labels(move_dicts), None)
+    for i, (headers, moves) in enumerate(games):
+        if labels[i] is None:
+            try:
+                replayer = GameReplayer() if 'FEN' not in headers else GameReplayer.from_fen(headers['FEN'])
+                labels[i] = [move_label(replayer.ply, replayer.push(move)) for move in moves]
+            except Exception as e:
+                labels[i], errors[i] = [], str(e)
+    offsets = np.zeros(len(games)+1, dtype=np.int64)
+    np.cumsum([len(l) for l in labels], out=offsets[1:])
+    records = np.array([record for l in labels for record in l], dtype=LABEL_DTYPE)
+    return [headers for headers, _ in games], records, offsets, errors
+
+
+def _replay_chunk(path, start, end, share_prefixes=False):
+    # Worker task: read, tokenize and replay one chunk of a PGN file
+    if end is None:
+        games = list(read_pgn(path))
     else:
-        raise RuntimeError(f'Origin not found for {piece} moving to ({dest_row}, {dest_col})')
+        games = list(_read_pgn_lines(io.StringIO(_read_chunk(path, start, end), newline=None)))
+    return _replay_games(games, share_prefixes)
+
+
+def replay_corpus(paths, workers=None, chunk_size=1 << 20, share_prefixes=False):
+    '''
+    Replay every game in one or more PGN files across a pool of worker processes.
+    Yields (headers, labels, error) per game in input order, where labels is a LABEL_DTYPE array
+    with one record per ply. A game that fails to replay has labels set to None and the error
+    message in error, without stopping the rest of the corpus.
+    Uncompressed files are split into byte ranges of about chunk_size, and each worker reads,
+    tokenizes and replays its own range (games are split at blank lines followed by a header).
+    Compressed files are replayed whole by one worker each. Workers send back one compact label
+    array per chunk, so the calling process does little more than hand out ranges. At most two
+    chunks are in flight per worker. workers=1 replays in the calling process.
+    With share_prefixes=True each chunk is replayed with replay_shared, so opening moves
+    common to games in the same chunk are replayed once.
+    '''
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    chunks = _corpus_chunks(paths, chunk_size)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        for chunk in chunks:
+            yield from _chunk_results(*_replay_chunk(*chunk, share_prefixes))
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_replay_chunk, *chunk, share_prefixes))
+            if len(pending) >= 2*workers:
+                yield from _chunk_results(*pending.popleft().result())
+        while pending:
+            yield from _chunk_results(*pending.popleft().result())
+
+
+def _chunk_results(headers, labels, offsets, errors):
+    for i, error in enumerate(errors):
+        yield headers[i], None if error else labels[offsets[i]:offsets[i+1]], error
+
+
+# Move label stored alongside each exported position; squares are row*8 + col
+LABEL_DTYPE = np.dtype([('ply', np.int16), ('piece', np.int8), ('origin', np.int8), ('dest', np.int8),
+                        ('promote', np.int8), ('capture', np.bool_), ('castle', np.bool_),
+                        ('check', np.bool_), ('mate', np.bool_)])
 
 
-def queen_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
+def move_label(ply, move_dicts):
+    '''
+    Build the LABEL_DTYPE record for one parsed and resolved move.
+    Castling is labelled by its king move and promotion by the pawn move with the promoted piece code.
+    '''
+    d = move_dicts[1] if move_dicts[0]['castle'] else move_dicts[0]
+    color = d['piece'][0]
+    promote = PIECE_CODES[color+d['promote_type']] if d['promote'] else 0
+    return (ply, PIECE_CODES[d['piece']], d['origin_row']*8 + d['origin_col'], d['dest_row']*8 + d['dest_col'],
+            promote, d['capture'], d['castle'], d['check'], d['mate'])
+
+
+class PositionWriter:
+    '''
+    Append positions and move labels to a directory of .npy shards.
+    Each position is the board before a move, stored as bit-packed (12, 8) planes by default
+    or as full (12, 8, 8) planes with packed=False, next to its LABEL_DTYPE move label.
+    Shards are numbered after any already in the directory, so writing again appends.
+    An optional PositionCache reuses the planes of positions already seen in earlier games.
+    '''
+
+    def __init__(self, directory, shard_size=1 << 20, packed=True, cache=None):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.packed = packed
+        self.cache = cache
+        os.makedirs(directory, exist_ok=True)
+        self.shard = len([f for f in os.listdir(directory) if f.startswith('positions-')])
+        self._positions = np.empty((shard_size, 12, 8) if packed else (shard_size, 12, 8, 8), dtype=np.uint8)
+        self._labels = np.empty(shard_size, dtype=LABEL_DTYPE)
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, board, label):
+        planes = board.to_packed if self.packed else board.to_planes
+        self._positions[self._count] = planes() if self.cache is None else self.cache.get(board.hash, planes)
+        self._labels[self._count] = label
+        self._count += 1
+        if self._count == self.shard_size:
+            self.flush()
+
+    def add_game(self, moves, start_fen=None):
+        '''
+        Replay a game, from start_fen if given, and add the position before every move with its label.
+        Label plies count from the start of the game, so a game from a FEN starts at that FEN's ply.
+        Nothing is written for a game that fails to replay; the error is raised.
+        '''
+        replayer = GameReplayer() if start_fen is None else GameReplayer.from_fen(start_fen)
+        positions, labels = [], []
+        for move in moves:
+            positions.append(replayer.board.copy())
+            labels.append(move_label(replayer.ply, replayer.push(move)))
+        for board, label in zip(positions, labels):
+            self.add(board, label)
+        return len(labels)
+
+    def flush(self):
+        if not self._count:
+            return
+        name = f'{self.shard:05d}.npy'
+        np.save(os.path.join(self.directory, 'positions-'+name), self._positions[:self._count])
+        np.save(os.path.join(self.directory, 'labels-'+name), self._labels[:self._count])
+        self.shard += 1
+        self._count = 0
+
+    def close(self):
+        self.flush()
+
+
+def export_positions(games, directory, shard_size=1 << 20, packed=True, cache=None):
+    '''
+    Replay games and write every position with its move label to .npy shards in directory.
+    games is an iterable of move lists or of (headers, moves) pairs such as read_pgn yields;
+    games with a FEN header start from that position.
+    Games that fail to replay are skipped. Returns (positions written, games skipped).
+    '''
+    written, skipped = 0, 0
+    with PositionWriter(directory, shard_size, packed, cache) as writer:
+        for game in games:
+            headers, moves = game if isinstance(game, tuple) else ({}, game)
+            try:
+                written += writer.add_game(moves, headers.get('FEN'))
+            except Exception:
+                skipped += 1
+    return written, skipped
+
+
+class PositionDataset:
+    '''
+    Read positions and labels written by PositionWriter without copying them into memory.
+    Shards are opened as memory-mapped arrays; indexing returns unpacked (12, 8, 8) planes and the label.
+    '''
+
+    def __init__(self, directory):
+        names = sorted(f[len('positions-'):] for f in os.listdir(directory) if f.startswith('positions-'))
+        self.positions = [np.load(os.path.join(directory, 'positions-'+n), mmap_mode='r') for n in names]
+        self.labels = [np.load(os.path.join(directory, 'labels-'+n), mmap_mode='r') for n in names]
+        self.offsets = np.cumsum([0] + [len(p) for p in self.positions])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        planes = self.positions[shard][idx - self.offsets[shard]]
+        if planes.ndim == 2:
+            planes = unpack_planes(planes)
+        return planes, self.labels[shard][idx - self.offsets[shard]]
+
+    def sample(self, n, seed=None):
+        '''
+        Return n randomly chosen positions as a (n, 12, 8, 8) array with their labels.
+        '''
+        idx = np.random.default_rng(seed).choice(len(self), size=n, replace=False)
+        items = [self[int(i)] for i in idx]
+        return np.stack([p for p, _ in items]), np.array([l for _, l in items], dtype=LABEL_DTYPE)
+
+
+def _import_pyarrow():
     try:
-        return bishop_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                           dest_row=dest_row, dest_col=dest_col, capture=capture)
-    except:
-        return rook_move(piece=piece, origin_row=origin_row, origin_col=origin_col,
-                         dest_row=dest_row, dest_col=dest_col, capture=capture)
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet output requires the pyarrow package')
+    return pyarrow, pyarrow.parquet
 
 
-def king_move(piece, origin_row, origin_col, dest_row, dest_col, capture, update_board = True):
-    locs = get_locs(piece)
-    o_row, o_col = locs
-    if update_board:
-        board.iloc[o_row, o_col] = float('nan')
-        board.iloc[dest_row, dest_col] = piece
-    return (o_row, o_col)
\ No newline at end of file
+# Square names indexed by row*8 + col, used as the dictionary of the origin and dest columns
+SQUARE_NAMES = ['abcdefgh'[sq & 7] + str(8 - (sq >> 3)) for sq in range(64)]
+
+
+def parquet_schema(boards=False):
+    '''
+    Arrow schema of the move tables written by MoveTableWriter, one row per ply.
+    Pieces and squares are dictionary-encoded with int8 indices equal to their piece code and
+    row*8 + col square, SAN tokens are dictionary-encoded and flags are bool. With boards=True
+    a 96-byte column holds the bit-packed (12, 8) planes of the board before the move.
+    '''
+    pa, _ = _import_pyarrow()
+    code = pa.dictionary(pa.int8(), pa.string())
+    fields = [('game', pa.int32()), ('ply', pa.int16()), ('san', pa.dictionary(pa.int32(), pa.string())),
+              ('piece', code), ('origin', code), ('dest', code), ('promote', code),
+              ('capture', pa.bool_()), ('castle', pa.bool_()), ('check', pa.bool_()), ('mate', pa.bool_())]
+    if boards:
+        fields.append(('board', pa.binary(96)))
+    return pa.schema(fields)
+
+
+class MoveTableWriter:
+    '''
+    Stream replayed games into a directory of Parquet files, one row per ply.
+    Rows are buffered into Arrow record batches of row_group_size, each written as one row group,
+    and a new moves-XXXXX.parquet file is started every file_rows rows. Files are numbered after
+    any already in the directory and game ids continue from the largest one found, so writing again appends.
+    Requires pyarrow.
+    '''
+
+    def __init__(self, directory, file_rows=1 << 22, row_group_size=1 << 16, boards=False):
+        self.pa, self.pq = _import_pyarrow()
+        self.directory = directory
+        self.file_rows = file_rows
+        self.row_group_size = row_group_size
+        self.boards = boards
+        self.schema = parquet_schema(boards)
+        os.makedirs(directory, exist_ok=True)
+        existing = _parquet_files(directory)
+        self.part = len(existing)
+        self.game = 1 + max((_game_range(rg)[1] for path in existing
+                             for rg in _row_groups(self.pq.ParquetFile(path).metadata)), default=-1)
+        self._labels = np.empty(row_group_size, dtype=LABEL_DTYPE)
+        self._games = np.empty(row_group_size, dtype=np.int32)
+        self._boards = np.empty((row_group_size, 96), dtype=np.uint8) if boards else None
+        self._san = []
+        self._count = 0
+        self._file = None
+        self._rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_game(self, moves, start_fen=None):
+        '''
+        Replay a game, from start_fen if given, and add a row for every move. Every call takes
+        the next game id, so ids follow the input order even when games fail; nothing is written
+        for a game that fails to replay and the error is raised.
+        '''
+        game = self.game
+        self.game += 1
+        replayer = GameReplayer() if start_fen is None else GameReplayer.from_fen(start_fen)
+        rows = []
+        for move in moves:
+            packed = replayer.board.to_packed() if self.boards else None
+            rows.append((move_label(replayer.ply, replayer.push(move)), move, packed))
+        for label, move, packed in rows:
+            self._labels[self._count] = label
+            self._games[self._count] = game
+            self._san.append(move)
+            if self.boards:
+                self._boards[self._count] = packed.reshape(96)
+            self._count += 1
+            if self._count == self.row_group_size:
+                self.flush()
+        return len(rows)
+
+    def flush(self):
+        if not self._count:
+            return
+        pa, n = self.pa, self._count
+        labels = self._labels[:n]
+        pieces, squares = pa.array(PIECES), pa.array(SQUARE_NAMES)
+        arrays = [pa.array(self._games[:n]), pa.array(labels['ply']), pa.array(self._san, pa.string()).dictionary_encode(),
+                  pa.DictionaryArray.from_arrays(pa.array(labels['piece']), pieces),
+                  pa.DictionaryArray.from_arrays(pa.array(labels['origin']), squares),
+                  pa.DictionaryArray.from_arrays(pa.array(labels['dest']), squares),
+                  pa.DictionaryArray.from_arrays(pa.array(labels['promote'], mask=labels['promote'] == 0), pieces)]
+        arrays += [pa.array(labels[flag]) for flag in ('capture', 'castle', 'check', 'mate')]
+        if self.boards:
+            arrays.append(pa.FixedSizeBinaryArray.from_buffers(pa.binary(96), n, [None, pa.py_buffer(self._boards[:n].tobytes())]))
+        if self._file is None:
+            path = os.path.join(self.directory, f'moves-{self.part:05d}.parquet')
+            self._file = self.pq.ParquetWriter(path, self.schema, compression='zstd')
+        self._file.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema), row_group_size=n)
+        self._rows += n
+        self._san = []
+        self._count = 0
+        if self._rows >= self.file_rows:
+            self._close_file()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.part += 1
+            self._rows = 0
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+
+def export_parquet(games, directory, file_rows=1 << 22, row_group_size=1 << 16, boards=False):
+    '''
+    Replay games and write one row per move to Parquet files in directory.
+    games is an iterable of move lists or of (headers, moves) pairs such as read_pgn yields;
+    games with a FEN header start from that position.
+    Games that fail to replay are skipped. Returns (rows written, games skipped).
+    '''
+    written, skipped = 0, 0
+    with MoveTableWriter(directory, file_rows, row_group_size, boards) as writer:
+        for game in games:
+            headers, moves = game if isinstance(game, tuple) else ({}, game)
+            try:
+                written += writer.add_game(moves, headers.get('FEN'))
+            except Exception:
+                skipped += 1
+    return written, skipped
+
+
+def _parquet_files(directory):
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.startswith('moves-') and f.endswith('.parquet')]
+
+
+def _row_groups(metadata):
+    return [metadata.row_group(i) for i in range(metadata.num_row_groups)]
+
+
+def _game_range(row_group):
+    # game is the first column; row groups without statistics could hold any game
+    stats = row_group.column(0).statistics
+    if stats is None or not stats.has_min_max:
+        return 0, np.iinfo(np.int32).max
+    return stats.min, stats.max
+
+
+def read_parquet(directory, columns=None, games=None):
+    '''
+    Load the move tables written by MoveTableWriter as a pyarrow Table.
+    Only the listed columns are decoded. With games, an iterable of game ids, row groups whose
+    game id range cannot contain any of them are skipped using the file statistics, so reading
+    a few games does not touch the rest of the corpus. Use .to_pandas() for a DataFrame.
+    '''
+    pa, pq = _import_pyarrow()
+    import pyarrow.compute as pc
+    wanted = None if games is None else np.unique(np.fromiter(games, dtype=np.int64))
+    read_columns = None if columns is None else list(columns) + (['game'] if 'game' not in columns else [])
+    tables = []
+    for path in _parquet_files(directory):
+        f = pq.ParquetFile(path)
+        groups = range(f.metadata.num_row_groups)
+        if wanted is not None:
+            ranges = [_game_range(rg) for rg in _row_groups(f.metadata)]
+            groups = [i for i in groups if np.any((wanted >= ranges[i][0]) & (wanted <= ranges[i][1]))]
+        if groups:
+            tables.append(f.read_row_groups(groups, columns=read_columns))
+    if not tables:
+        schema = parquet_schema(boards=True)
+        return schema.empty_table().select(columns or schema.names[:-1])
+    table = pa.concat_tables(tables, promote_options='permissive')
+    if wanted is not None:
+        table = table.filter(pc.is_in(table['game'], value_set=pa.array(wanted, pa.int32())))
+    return table if columns is None else table.select(list(columns))
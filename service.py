@@ -0,0 +1,298 @@
+'''
+Asyncio conversion service for chess_functions.
+
+Accepts games in algebraic notation over HTTP, on a TCP port or a Unix socket, and returns
+the parsed moves, optional FEN positions and optional bit-packed plane tensors. Requests are
+grouped into batches and replayed in a process pool, so one warm, long-running converter
+replaces per-request Python startup.
+
+Endpoints:
+    POST /convert   {"moves": ["e4", "e5", ...] or "e4 e5 ...", "start_fen": optional,
+                     "validate": false, "fens": false, "tensors": false}
+    GET  /metrics   request, error and rejection counts, latency percentiles and throughput
+    GET  /health
+
+Usage:
+    python service.py --port 8765 --workers 4
+    python service.py --unix /tmp/chess.sock
+'''
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import chess_functions as cf
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+MAX_HEADERS = 100
+
+
+def _jsonable(move_dict):
+    # JSON has no NaN, so missing values in the move dictionaries become null
+    return {k: (None if isinstance(v, float) and v != v else v) for k, v in move_dict.items()}
+
+
+def convert_game(request):
+    '''
+    Replay one game described by a request dictionary and return the response dictionary.
+    Errors in the game are returned as {"error": message, "ply": ply} rather than raised.
+    '''
+    moves = request.get('moves', [])
+    if isinstance(moves, str):
+        moves = moves.split()
+    replayer = cf.GameReplayer(validate=bool(request.get('validate')))
+    want_fens = bool(request.get('fens'))
+    want_tensors = bool(request.get('tensors'))
+    fens, packed, move_dicts = [], [], []
+    try:
+        if request.get('start_fen'):
+            replayer.reset(request['start_fen'])
+        if want_fens:
+            fens.append(replayer.fen)
+        for move in moves:
+            if want_tensors:
+                packed.append(replayer.board.to_packed())
+            move_dicts.extend(replayer.push(move))
+            if want_fens:
+                fens.append(replayer.fen)
+    except Exception as e:
+        return {'error': str(e), 'ply': replayer.ply}
+    result = {'moves': [_jsonable(d) for d in move_dicts], 'plies': len(moves), 'fen': replayer.fen}
+    if want_fens:
+        result['fens'] = fens
+    if want_tensors:
+        tensors = np.stack(packed) if packed else np.empty((0, 12, 8), dtype=np.uint8)
+        result['tensors'] = base64.b64encode(tensors.tobytes()).decode('ascii')
+        result['tensor_shape'] = list(tensors.shape)
+    return result
+
+
+def convert_batch(requests):
+    return [convert_game(request) for request in requests]
+
+
+def _warm_up():
+    # Run once per worker at startup so process spawn and imports are not paid by the first request
+    return os.getpid()
+
+
+class ConversionService:
+    '''
+    Batching front-end over a process pool.
+    Incoming requests wait in a bounded queue; batcher tasks, one per worker process, take up to
+    batch_size requests (waiting at most max_delay seconds to fill a batch) and replay them in the pool.
+    When the queue is full new requests are rejected with 503 instead of piling up.
+    '''
+
+    def __init__(self, workers=None, batch_size=32, max_delay=0.005, max_pending=1024, max_body=1 << 20):
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.pool = None
+        self.queue = None
+        self.tasks = []
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.plies = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=10000)
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers)])
+        self.queue = asyncio.Queue(self.max_pending)
+        self.tasks = [asyncio.create_task(self._batcher()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+
+    async def submit(self, request):
+        '''
+        Queue a conversion request and wait for its result; raises asyncio.QueueFull when saturated.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((request, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            try:
+                results = await loop.run_in_executor(self.pool, convert_batch, [r for r, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self):
+        elapsed = time.monotonic() - self.started
+        latencies = np.array(self.latencies) * 1000
+        percentiles = np.percentile(latencies, [50, 95, 99]).tolist() if len(latencies) else [None]*3
+        return {'uptime_sec': elapsed, 'requests': self.requests, 'errors': self.errors,
+                'rejected': self.rejected, 'pending': self.queue.qsize(), 'batches': self.batches,
+                'plies': self.plies, 'requests_per_sec': self.requests / elapsed,
+                'plies_per_sec': self.plies / elapsed,
+                'latency_ms': dict(zip(['p50', 'p95', 'p99'], percentiles))}
+
+    async def _route(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics()
+        if path != '/convert':
+            return 404, {'error': f'Unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST for /convert'}
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            return 400, {'error': f'Invalid JSON: {e}'}
+        if not isinstance(request, dict):
+            return 400, {'error': 'Request body must be a JSON object'}
+        start = time.monotonic()
+        try:
+            result = await self.submit(request)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503, {'error': 'Too many pending requests'}
+        self.latencies.append(time.monotonic() - start)
+        self.requests += 1
+        if 'error' in result:
+            self.errors += 1
+            return 400, result
+        self.plies += result['plies']
+        return 200, result
+
+    async def handle(self, reader, writer):
+        '''
+        Serve HTTP/1.1 requests on one connection, keeping it open unless the client asks to close.
+        '''
+        try:
+            while True:
+                try:
+                    request_line, headers = await self._read_head(reader)
+                except (ValueError, asyncio.LimitOverrunError):
+                    # readline raises ValueError for a line longer than the stream limit
+                    await self._respond(writer, 431, {'error': 'Request line or headers too large'}, False)
+                    break
+                if not request_line.strip():
+                    break
+                try:
+                    method, path, _ = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {'error': 'Invalid Content-Length'}, False)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, 413, {'error': 'Request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, payload = await self._route(method, path.split('?')[0], body)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader):
+        request_line = await reader.readline()
+        headers = {}
+        if not request_line.strip():
+            return request_line, headers
+        for _ in range(MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return request_line, headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        raise ValueError('Too many headers')
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        head = (f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=8765, unix_path=None, **options):
+    '''
+    Run the conversion service until cancelled, on a Unix socket if unix_path is given.
+    '''
+    service = ConversionService(**options)
+    await service.start()
+    if unix_path:
+        server = await asyncio.start_unix_server(service.handle, path=unix_path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--workers', type=int, default=None, help='replay processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=32, help='maximum requests per batch')
+    parser.add_argument('--max-delay-ms', type=float, default=5, help='longest wait to fill a batch')
+    parser.add_argument('--max-pending', type=int, default=1024, help='queued requests before rejecting with 503')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, workers=args.workers, batch_size=args.batch_size,
+                          max_delay=args.max_delay_ms / 1000, max_pending=args.max_pending))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
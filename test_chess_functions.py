@@ -0,0 +1,343 @@
+import gzip
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import chess_functions as cf
+from benchmark import SEED_GAMES
+
+ENDGAME_FEN = '4k3/8/8/8/8/8/4P3/4K3 w - - 0 10'
+KIWIPETE = 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'
+
+
+def perft(board, white, depth):
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in cf.legal_moves(board, white):
+        undo = cf.make_move(board, move)
+        nodes += perft(board, not white, depth-1)
+        cf.unmake_move(board, undo)
+    return nodes
+
+
+@pytest.mark.parametrize('fen, counts', [
+    (cf.STARTING_FEN, [20, 400, 8902]),
+    (KIWIPETE, [48, 2039, 97862]),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812]),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467]),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379]),
+])
+def test_perft(fen, counts):
+    board, ply, _ = cf.parse_fen(fen)
+    for depth, count in enumerate(counts, 1):
+        assert perft(board, ply % 2 == 0, depth) == count
+    assert board.to_fen(ply % 2 == 0, *fen.split()[4:6]) == fen
+
+
+@pytest.mark.parametrize('moves', [g.split() for g in SEED_GAMES])
+def test_seed_games_are_legal(moves):
+    cf.GameReplayer(validate=True).replay(moves)
+
+
+@pytest.mark.parametrize('moves', [g.split() for g in SEED_GAMES])
+def test_undo_redo_round_trip(moves):
+    replayer = cf.GameReplayer(keep_history=True)
+    states = [(replayer.fen, replayer.key)]
+    for move in moves:
+        replayer.push(move)
+        states.append((replayer.fen, replayer.key))
+    for state in reversed(states[:-1]):
+        replayer.undo()
+        assert (replayer.fen, replayer.key) == state
+    for state in states[1:]:
+        replayer.redo()
+        assert (replayer.fen, replayer.key) == state
+
+
+@pytest.mark.parametrize('moves', [g.split() for g in SEED_GAMES])
+def test_fen_round_trip_and_resume(moves):
+    full = cf.GameReplayer()
+    full.replay(moves)
+    half = cf.GameReplayer()
+    half.replay(moves[:len(moves)//2])
+    assert cf.GameReplayer.from_fen(half.fen).fen == half.fen
+    resumed = cf.GameReplayer()
+    resumed.replay(moves[len(moves)//2:], start_fen=half.fen)
+    assert (resumed.fen, resumed.key) == (full.fen, full.key)
+
+
+def test_parse_moves_matches_parse_move():
+    moves = [move for game in SEED_GAMES for move in game.split()] + ['Zz9', 'e4e5', 'O-O-O+']
+    expected = [d for i, move in enumerate(moves) for d in cf.parse_move(i, move)]
+    frame = cf.parse_moves(moves)
+    assert len(frame) == len(expected)
+    for (_, row), d in zip(frame.iterrows(), expected):
+        for key, value in d.items():
+            assert (pd.isna(row[key]) and pd.isna(value)) or row[key] == value, key
+
+
+@pytest.mark.parametrize('keep_history', [False, True])
+def test_unparseable_move_raises(keep_history):
+    replayer = cf.GameReplayer(keep_history=keep_history)
+    replayer.push('e4')
+    with pytest.raises(RuntimeError, match='not algebraic notation'):
+        replayer.push('--')
+    assert replayer.ply == 1
+    replayer.push('e5')
+    assert replayer.fen.startswith('rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w')
+
+
+def test_replay_shared_fails_only_unparseable_game():
+    results = cf.replay_shared([['e4', '--', 'e5'], ['e4', 'e5']])
+    assert results[0][0] is None and 'not algebraic notation' in results[0][1]
+    assert results[1][1] is None and len(results[1][0]) == 2
+
+
+@pytest.mark.parametrize('moves', [['Qh5h4'], ['exd5']])
+def test_given_origin_must_hold_the_piece(moves):
+    with pytest.raises(RuntimeError, match='Origin not found'):
+        cf.GameReplayer().replay(moves)
+
+
+def test_parse_moves_drops_missing_tokens():
+    frame = cf.parse_moves(pd.Series(['e4', None, 'Nf6', float('nan')]))
+    assert frame['move'].tolist() == ['e4', 'Nf6']
+    assert frame['piece'].tolist() == ['wP', 'wN']
+    assert frame['move_num'].tolist() == [0, 2]
+
+
+def test_undo_redo_errors():
+    with pytest.raises(RuntimeError, match='history not enabled'):
+        cf.GameReplayer().undo()
+    replayer = cf.GameReplayer(keep_history=True)
+    with pytest.raises(RuntimeError, match='nothing to undo'):
+        replayer.undo()
+    with pytest.raises(RuntimeError, match='nothing to redo'):
+        replayer.redo()
+
+
+def test_export_positions_honours_fen_header(tmp_path):
+    games = [({'FEN': ENDGAME_FEN}, ['e4', 'Kd7', 'e5'])]
+    assert cf.export_positions(games, tmp_path) == (3, 0)
+    dataset = cf.PositionDataset(tmp_path)
+    replayer = cf.GameReplayer.from_fen(ENDGAME_FEN)
+    for i, move in enumerate(['e4', 'Kd7', 'e5']):
+        planes, label = dataset[i]
+        assert np.array_equal(planes, replayer.board.to_planes())
+        assert label['ply'] == 18 + i
+        replayer.push(move)
+
+
+def test_export_parquet_honours_fen_header(tmp_path):
+    pytest.importorskip('pyarrow')
+    moves = ['e4', 'Kd7', 'e5']
+    assert cf.export_parquet([({'FEN': ENDGAME_FEN}, moves), moves], tmp_path, boards=True) == (6, 0)
+    table = cf.read_parquet(tmp_path, games=[0]).to_pydict()
+    assert table['ply'] == [18, 19, 20]
+    assert table['origin'] == ['e2', 'e8', 'e4'] and table['dest'] == ['e4', 'd7', 'e5']
+    replayer = cf.GameReplayer.from_fen(ENDGAME_FEN)
+    for board, move in zip(table['board'], moves):
+        assert board == replayer.board.to_packed().tobytes()
+        replayer.push(move)
+    assert cf.read_parquet(tmp_path, columns=['san'], games=[1]).column('san').to_pylist() == moves
+
+
+@pytest.mark.parametrize('request_bytes, status', [
+    (b'POST /convert HTTP/1.1\r\nContent-Length: abc\r\n\r\n{}', b'400'),
+    (b'POST /convert HTTP/1.1\r\nContent-Length: -5\r\n\r\n{}', b'400'),
+    (b'GET /' + b'a'*70000 + b' HTTP/1.1\r\n\r\n', b'431'),
+    (b'GET /health HTTP/1.1\r\nX-Long: ' + b'a'*70000 + b'\r\n\r\n', b'431'),
+    (b'GET /health HTTP/1.1\r\n' + b'X: 1\r\n'*200 + b'\r\n', b'431'),
+], ids=['non-numeric length', 'negative length', 'long request line', 'long header', 'many headers'])
+def test_service_rejects_malformed_requests(request_bytes, status):
+    import asyncio
+    from service import ConversionService
+
+    async def request():
+        service = ConversionService(workers=1)
+        await service.start()
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        try:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(request_bytes)
+            await writer.drain()
+            response = await reader.readline()
+            writer.close()
+            return response
+        finally:
+            server.close()
+            await service.stop()
+
+    assert asyncio.run(request()).startswith(b'HTTP/1.1 ' + status)
+
+
+@pytest.mark.parametrize('move', ['Kg1', 'Kc1'])
+def test_validate_rejects_king_move_to_castling_square(move):
+    replayer = cf.GameReplayer.from_fen('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', validate=True)
+    with pytest.raises(RuntimeError, match='no legal origin'):
+        replayer.push(move)
+    replayer.push('O-O' if move == 'Kg1' else 'O-O-O')
+    assert replayer.fen.split()[0] == ('r3k2r/8/8/8/8/8/8/R4RK1' if move == 'Kg1' else 'r3k2r/8/8/8/8/8/8/2KR3R')
+
+
+@pytest.mark.parametrize('keep_history', [False, True])
+def test_false_check_suffix_leaves_replayer_unchanged(keep_history):
+    replayer = cf.GameReplayer(validate=True, keep_history=keep_history)
+    replayer.replay(['e4', 'e5'])
+    state = (replayer.fen, replayer.key, replayer.ply, replayer.halfmove)
+    with pytest.raises(RuntimeError, match='gives no check'):
+        replayer.push('Nf3+')
+    assert (replayer.fen, replayer.key, replayer.ply, replayer.halfmove) == state
+    assert len(replayer.history or []) == (2 if keep_history else 0)
+    replayer.push('Nf3')
+
+
+def test_pawn_capture_onto_empty_square_needs_en_passant():
+    with pytest.raises(RuntimeError, match='Origin not found'):
+        cf.GameReplayer().replay('e4 Nf6 e5 d5 exd6 Nc6 dxc7 Qd7 cxb8=N+'.split())
+    replayer = cf.GameReplayer()
+    replayer.replay('e4 Nf6 e5 d5 exd6'.split())
+    assert replayer.fen.split()[0] == 'rnbqkb1r/ppp1pppp/3P1n2/8/8/8/PPPP1PPP/RNBQKBNR'
+
+
+@pytest.mark.parametrize('moves', [g.split() for g in SEED_GAMES])
+def test_move_selector_replays_parse_moves_frame(moves):
+    board = cf.Board()
+    for row in cf.parse_moves(moves).itertuples():
+        cf.move_selector(row.piece, row.origin_row, row.origin_col, row.dest_row, row.dest_col,
+                         row.capture, board=board)
+    assert all(type(bb) is int for bb in board.bitboards)
+    replayer = cf.GameReplayer()
+    replayer.replay(moves)
+    assert board.squares == replayer.board.squares and board.hash == replayer.board.hash
+    assert sorted(cf.legal_moves(board, len(moves) % 2 == 0)) == sorted(cf.legal_moves(replayer.board, len(moves) % 2 == 0))
+
+
+def write_corpus(path, newline='\n'):
+    games = [({'Event': f'Game {i}'}, moves) for i, moves in enumerate(g.split() for g in SEED_GAMES*3)]
+    games.insert(4, ({'Event': 'Endgame', 'FEN': ENDGAME_FEN, 'SetUp': '1'}, ['e4', 'Kd7', 'e5']))
+    games.insert(9, ({'Event': 'Broken'}, ['e4', 'e5', 'Nd5']))
+    text = ''
+    for headers, moves in games:
+        text += ''.join(f'[{k} "{v}"]\n' for k, v in headers.items())
+        text += '\n' + ' '.join(f'{i//2+1}. {m}' if i % 2 == 0 else m for i, m in enumerate(moves)) + ' *\n\n'
+    if str(path).endswith('.gz'):
+        with gzip.open(path, 'wt', newline=newline) as f:
+            f.write(text)
+    else:
+        with open(path, 'w', newline=newline) as f:
+            f.write(text)
+    return games
+
+
+def expected_labels(headers, moves):
+    replayer = cf.GameReplayer.from_fen(headers['FEN']) if 'FEN' in headers else cf.GameReplayer()
+    return np.array([cf.move_label(replayer.ply, replayer.push(move)) for move in moves], dtype=cf.LABEL_DTYPE)
+
+
+@pytest.mark.parametrize('name, newline', [('games.pgn', '\n'), ('games.pgn', '\r\n'), ('games.pgn.gz', '\n')])
+@pytest.mark.parametrize('chunk_size', [7, 97, 1 << 22])
+@pytest.mark.parametrize('workers, share_prefixes', [(1, False), (1, True), (2, False)])
+def test_replay_corpus_matches_sequential_replay(tmp_path, name, newline, chunk_size, workers, share_prefixes):
+    games = write_corpus(tmp_path / name, newline)
+    results = list(cf.replay_corpus([tmp_path / name, tmp_path / name], workers, chunk_size, share_prefixes))
+    assert [headers for headers, _, _ in results] == [headers for headers, _ in games]*2
+    for (headers, labels, error), (_, moves) in zip(results, games*2):
+        if headers['Event'] == 'Broken':
+            assert labels is None and 'Origin not found' in error
+        else:
+            assert error is None and np.array_equal(labels, expected_labels(headers, moves))
+
+
+PGN_TEXT = '''% escaped line: [Event "ignored"] e4
+[Event "First"]
+[Site "?"]
+
+1. e4 {a comment
+spanning [three] lines (with parens)
+1. d4} e5 $1 2. Nf3!? (2. Nc3 (2. f4 exf4) Nc6) Nc6 ; line comment 3. d4
+3. Bb5 a6?! {short} 4. Ba4 1-0
+
+[Event "Second"]
+
+1. d4 d5 2. c4
+[Event "Third"]
+[FEN "4k3/8/8/8/8/8/4P3/4K3 w - - 0 10"]
+
+10. e4 Kd7 1/2-1/2
+'''
+
+
+def test_read_pgn_strips_comments_variations_and_nags(tmp_path):
+    expected = [({'Event': 'First', 'Site': '?'}, ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6', 'Ba4']),
+                ({'Event': 'Second'}, ['d4', 'd5', 'c4']),
+                ({'Event': 'Third', 'FEN': '4k3/8/8/8/8/8/4P3/4K3 w - - 0 10'}, ['e4', 'Kd7'])]
+    assert list(cf.read_pgn(io.StringIO(PGN_TEXT))) == expected
+    with gzip.open(tmp_path / 'games.pgn.gz', 'wt') as f:
+        f.write(PGN_TEXT)
+    assert list(cf.read_pgn(tmp_path / 'games.pgn.gz')) == expected
+    assert [len(move_dicts) for _, move_dicts in cf.replay_pgn(io.StringIO(PGN_TEXT))] == [7, 3, 2]
+
+
+def test_replay_shared_matches_independent_replay():
+    games = [g.split() for g in SEED_GAMES] + [
+        'e4 e5 Nf3 Nc6 Bb5'.split(),
+        'e4 e5 Nf3 Nc6 Bc4'.split(),    # diverges at the last move
+        'e4 e5 Nf3'.split(),            # prefix of the two above
+        'e4 e5 Nf3 Nc6 Bb5'.split(),    # duplicate game
+        'e4 e5 Nf3 d6 d4 Bg4'.split(),  # prefix of the opera game
+        'd4 d5 c4'.split(),
+        [],
+    ]
+    results = cf.replay_shared(games)
+    for moves, (move_dicts, error) in zip(games, results):
+        assert error is None
+        assert move_dicts == cf.GameReplayer().replay(moves)
+    # Results are independent copies, even for games that share every move
+    results[3][0][0]['origin_row'] = None
+    assert results[8][0][0]['origin_row'] == 6
+
+
+def replayed(moves):
+    replayer = cf.GameReplayer()
+    replayer.replay(moves.split())
+    return replayer
+
+
+def test_zobrist_keys_match_transpositions():
+    a, b = replayed('Nf3 Nf6 Nc3 Nc6'), replayed('Nc3 Nc6 Nf3 Nf6')
+    assert a.key == b.key and a.board.hash == b.board.hash
+    # The incremental hash matches one computed from scratch
+    assert a.board.hash == cf.Board(a.board.squares).hash
+    # Knights back home repeat the start position, castling rights included
+    assert replayed('Nf3 Nf6 Ng1 Ng8').key == cf.GameReplayer().key
+    # Same placement, but rooks that moved and came back have lost their castling rights
+    lost = replayed('Nf3 Nf6 Rg1 Rg8 Rh1 Rh8 Ng1 Ng8')
+    assert lost.board.squares == cf.Board().squares and lost.board.hash == cf.Board().hash
+    assert lost.key != cf.GameReplayer().key
+    # Same placement with the other side to move
+    black_to_move = cf.GameReplayer()
+    black_to_move.ply = 1
+    assert black_to_move.key == cf.GameReplayer().key ^ cf.ZOBRIST_BLACK_TO_MOVE
+
+
+def test_position_cache_lru_eviction_and_counts():
+    cache = cf.PositionCache(maxsize=2)
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value * 10
+
+    assert cache.get('a', compute, 1) == 10
+    assert cache.get('b', compute, 2) == 20
+    assert cache.get('a', compute, 99) == 10    # hit; 'a' becomes most recently used
+    assert cache.get('c', compute, 3) == 30     # evicts 'b', the least recently used
+    assert 'b' not in cache and 'a' in cache and len(cache) == 2
+    assert cache.get('b', compute, 4) == 40     # recomputed after eviction; evicts 'a'
+    assert 'a' not in cache
+    assert calls == [1, 2, 3, 4]
+    assert (cache.hits, cache.misses) == (1, 4)